@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import time
+import threading
+import uuid
+import BaseHTTPServer
+import SocketServer
+from post_bd import HTTPPool, BDPublisher
+
+"""
+    About:
+
+    This module is part of debugging tool for zwave network device connector.
+
+    The module runs a local stub of the BuildingDepot RESTful api used by
+    post_bd.py (access token, sensor search/creation, tags and timeseries),
+    which keeps connections alive and counts the connections, requests and
+    access tokens it served. Requests with a token it did not issue (or
+    revoked, by removing it from server.tokens) are refused with HTTP 401. Hence the reuse of connections by HTTPPool can be checked without
+    a BuildingDepot instance. Faults can be set on the server: the next
+    server.drop requests are dropped with the connection (as a stale
+    keep-alive connection), and each reply is delayed by server.delay
+    seconds.
+
+    Usage:
+        python bd_stub.py [port]
+            serve the stub api on localhost:port (default 8080) until Ctrl-C.
+        python bd_stub.py --measure [posts]
+            post the given number of payloads (default 200) to a stub on a
+            free port, once with a pooled keep-alive connection and once with
+            a new connection per payload, and print the counters of both.
+"""
+
+DEFAULT_PORT = 8080
+DEFAULT_POSTS = 200
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+        Class of StubServer: threaded http server holding the counters and
+        the sensors created by clients.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.samples = 0
+        self.sensors = {}        # source name -> uuid
+        self.tokens = set()      # access tokens issued
+        self.token_lifetime = 3600
+        self.drop = 0            # number of requests to drop
+        self.delay = 0           # seconds each reply is delayed
+
+    def stats(self):
+        """
+            Return: dict of counters of the stub
+        """
+        with self.lock:
+            return {"connections": self.connections, \
+                "requests": self.requests, "samples": self.samples, \
+                "sensors": len(self.sensors), "tokens": len(self.tokens)}
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+        Class of StubHandler: one instance per connection, which serves all
+        requests sent over the connection.
+    """
+    protocol_version = "HTTP/1.1"       # keep connections alive
+    wbufsize = -1                       # send each reply in one segment
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, data, status=200):
+        """
+            send a json reply.
+        """
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stall(self):
+        """
+            apply the faults set on the server, the reply is delayed, or 
+            the connection is closed without reply.
+
+            Return: True if the request is dropped
+        """
+        with self.server.lock:
+            drop = self.server.drop > 0
+            if drop:
+                self.server.drop -= 1
+            delay = self.server.delay
+        if delay:
+            time.sleep(delay)
+        if drop:
+            self.close_connection = 1
+        return drop
+
+    def body(self):
+        """
+            Return: the parsed json body of request
+        """
+        size = int(self.headers.getheader("Content-Length") or 0)
+        return json.loads(self.rfile.read(size)) if size else {}
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.stall():
+            return
+        if self.path.startswith("/oauth/access_token/"):
+            token = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.tokens.add(token)
+            self.reply({"access_token": token, \
+                "expires_in": self.server.token_lifetime})
+        else:
+            self.reply({"success": "False", "error": "Not Found"}, 404)
+
+    def do_POST(self):
+        data = self.body().get("data")
+        server = self.server
+        token = (self.headers.getheader("Authorization") or "").split()[-1:]
+        with server.lock:
+            server.requests += 1
+        if self.stall():
+            return
+        with server.lock:
+            if not token or token[0] not in server.tokens:
+                self.reply({"success": "False", "error": "Unauthorized"}, 401)
+            elif self.path == "/api/search":
+                src = data["Source_Name"][0]
+                found = [{"name": server.sensors[src]}] \
+                    if src in server.sensors else []
+                self.reply({"success": "True", "result": found})
+            elif self.path == "/api/sensor":
+                server.sensors.setdefault(data["name"], uuid.uuid4().hex)
+                self.reply({"success": "True", \
+                    "uuid": server.sensors[data["name"]]})
+            elif self.path.endswith("/tags"):
+                self.reply({"success": "True"})
+            elif self.path == "/api/sensor/timeseries":
+                server.samples += sum(len(d["samples"]) for d in data)
+                self.reply({"success": "True"})
+            else:
+                self.reply({"success": "False", "error": "Not Found"}, 404)
+
+def start_stub(port):
+    """
+        start the stub server in a background thread.
+
+        Args: port the port to listen on, 0 for a free port
+        Return: the instance of StubServer
+    """
+    server = StubServer(("127.0.0.1", port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def run_posts(server, posts, pooled):
+    """
+        post payloads to stub server.
+
+        Args:
+            server: the instance of StubServer
+            posts: number of payloads to post
+            pooled: True to share one HTTPPool between all payloads, False to
+                use a new connection for each payload
+        Return: (seconds elapsed, counters of stub, counters of pool)
+    """
+    setting = {"url": "http://127.0.0.1", \
+        "oauth_port": ":{}".format(server.server_address[1]), \
+        "port": ":{}".format(server.server_address[1]), \
+        "client_id": "stub", "client_key": "stub", "building": "stub", \
+        "identifier": "stub", "identity": "mac_id"}
+    pool = HTTPPool(1)
+    publisher = BDPublisher(setting, pool, path=None)
+    before = server.stats()
+    start = time.time()
+    for i in range(posts):
+        if not pooled:
+            pool.close()
+        payload = json.dumps({"sensor_data": {"mac_id": "stub", \
+            "Stub Temperature": 20 + i % 10}, "time": time.time()})
+        publisher.post(payload)
+    elapsed = time.time() - start
+    pool.close()
+    publisher.stop()
+    after = server.stats()
+    return elapsed, dict((k, after[k] - before[k]) for k in after), \
+        pool.stats()
+
+def measure(posts):
+    """
+        print the counters of posting with and without connection reuse.
+    """
+    server = start_stub(0)
+    for pooled in (True, False):
+        elapsed, stub, pool = run_posts(server, posts, pooled)
+        print("{} : {} payloads in {:.3f} s, {} connections for {} requests " \
+            "({} reused), {} tokens".format( \
+            "keep-alive" if pooled else "no reuse", posts, elapsed, \
+            stub["connections"], stub["requests"], pool["reused"], \
+            stub["tokens"]))
+    server.shutdown()
+
+def main():
+    """
+        Main of the BuildingDepot stub.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        posts = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_POSTS
+        measure(posts)
+        return
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    server = start_stub(port)
+    print("BuildingDepot stub listening on 127.0.0.1:{}".format(port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(server.stats())
+
+if __name__ == "__main__":
+    main()
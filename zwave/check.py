@@ -7,6 +7,7 @@ import resource
 import openzwave
 import sys
 import time
+import threading
 from config.setting import Setting
 from openzwave.node import ZWaveNode
 from openzwave.value import ZWaveValue
@@ -14,6 +15,8 @@ from openzwave.scene import ZWaveScene
 from openzwave.controller import ZWaveController
 from openzwave.network import ZWaveNetwork
 from openzwave.option import ZWaveOption
+from louie import dispatcher
+from zwave_network import NetworkStartup
 
 """
     About:
@@ -36,7 +39,7 @@ from openzwave.option import ZWaveOption
 CONFIG = "zwave"
 SEPARATOR_LENGTH = 60
 
-class ZwaveNetworkDebug:
+class ZwaveNetworkDebug(NetworkStartup):
     """
         Class of zwavenetwork:
         In the context of the instance of ZwaveNetwork the instance of zwave 
@@ -47,78 +50,7 @@ class ZwaveNetworkDebug:
             Initialize using zwave.json config file defined in CONFIG variable
         """
         multisensor_cred = Setting(CONFIG)
-        self.device = str(multisensor_cred.setting["device"])
-        self.log = str(multisensor_cred.setting["log"])
-        self.log_file = str(multisensor_cred.setting["log_file"])
-        self.write_file = bool(multisensor_cred.setting["write_log_file"])
-        self.output_console = bool(multisensor_cred.setting["write_console"])
-        # format config dict
-
-    def network_init(self):
-        """
-            Zwave network initialization.
-            Terminate program if initialization failed.
-        """
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger('openzwave')
-
-        # option initialization, abort if initialization failed
-        try:
-            options = ZWaveOption(self.device, \
-             config_path="../openzwave/config", \
-             user_path=".", cmd_line="")
-            options.set_log_file(self.log_file)
-            options.set_append_log_file(self.write_file)
-            options.set_console_output(self.output_console)
-            options.set_save_log_level(self.log)
-            options.set_logging(False)
-            options.lock()
-        except Exception as e:
-            print("Zwave initialization failed!")
-            print("Please check the USB port of Zwave Stick")
-            print(e)
-            sys.exit(-1)
-
-        # create a network instance
-        self.network = ZWaveNetwork(options, log=None)
-
-    def network_awake(self):
-        """
-            Awake zwave network.
-            Terminated program if awake failed! 
-        """
-        print("INFO: Waiting for network awaked :")
-
-        for i in range(0, 300):
-            if self.network.state >= self.network.STATE_AWAKED:
-                break
-            else:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                time.sleep(1.0)
-
-        if self.network.state < self.network.STATE_AWAKED:
-            sys.exit("Network is not awake, program abort!")
-
-        for i in range(0, 300):
-            if self.network.state >= self.network.STATE_READY:
-                break
-            else:
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                time.sleep(1.0)
-
-        if not self.network.is_ready:
-            sys.exit("Network is not ready, program abort!")
-        print("\nINFO: Network [{}] awaked!" .format(self.network.home_id_str))
-        print("INFO: Number of nodes: [{}]" .format(self.network.nodes_count))
-
-    def network_stop(self):
-        """
-            Stop network.
-        """
-        self.network.stop()
-        print("INFO: Network stopped")
+        self.init_startup(multisensor_cred.setting)
 
     def check_node_connection(self, node_id):
         """ 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import struct
+
+"""
+    About:
+    Device Connector - Wire Protocol
+
+    Descriptions:
+    This module defines the framing used between zwave_network.py (engine)
+     and sens_zwave.py (client). Each message is sent as one frame, which is
+     a 4 bytes length prefix (network byte order) followed by the payload:
+        <length><payload>
+
+    A command is sent by the client as a single frame. The engine replies
+     with one or more frames, and a frame with zero length marks the end of
+     the response. Hence the client returns as soon as the engine finishes,
+     instead of waiting for the connection being idle.
+"""
+
+HEADER = struct.Struct("!I")      # length prefix of each frame
+MAX_FRAME = 16 * 1024 * 1024      # refuse frames larger than 16 MB
+
+class FrameError(Exception):
+    """
+        raised when the peer closed the connection in the middle of a frame,
+        or sent a malformed frame
+    """
+    pass
+
+def recv_exact(sock, size):
+    """
+        receive exactly size bytes from socket.
+
+        Args:
+            sock: the connected socket
+            size: number of bytes to receive
+        Return: received string
+    """
+    chunks = []
+    while size > 0:
+        data = sock.recv(min(size, 65536))
+        if not data:
+            raise FrameError("Connection closed by peer")
+        chunks.append(data)
+        size -= len(data)
+    return "".join(chunks)
+
+def send_frame(sock, payload):
+    """
+        send one frame.
+
+        Args:
+            sock: the connected socket
+            payload: the string to send, "" is the end of response marker
+        Return: None
+    """
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+def send_end(sock):
+    """
+        send the end of response marker.
+
+        Args: sock the connected socket
+        Return: None
+    """
+    send_frame(sock, "")
+
+def recv_frame(sock):
+    """
+        receive one frame.
+
+        Args: sock the connected socket
+        Return: the payload string, "" for the end of response marker
+    """
+    (size, ) = HEADER.unpack(recv_exact(sock, HEADER.size))
+    if size > MAX_FRAME:
+        raise FrameError("Frame too large: {} bytes".format(size))
+    return recv_exact(sock, size)
+
+def recv_response(sock):
+    """
+        receive all frames of a response until end of response marker.
+
+        Args: sock the connected socket
+        Return: generator of payload strings
+    """
+    while True:
+        payload = recv_frame(sock)
+        if payload == "":
+            return
+        yield payload
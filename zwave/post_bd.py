@@ -0,0 +1,1612 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+import collections
+import os
+import re
+import heapq
+import random
+import socket
+import errno
+import httplib
+import urlparse
+import copy
+from bd_connect.connect_bd import get_json
+
+"""
+    About:
+    Device Connector - BuildingDepot Publisher
+
+    Descriptions:
+    This module gathers the sensor points read by zwave_network.py into
+     batched sensor_data payloads, so that a scan of the whole network is
+     posted to BuildingDepot with one or a few requests instead of one request
+     per sensor point.
+
+    Each sensor point is a dict in the same format as before:
+        {"mac_id": <mac id>, <source name>: <sensed value>}
+    and a batch is posted as:
+        {"sensor_data": [<sensor point>, <sensor point>, ...], "time": <time>}
+
+    The status of every sensor point is kept, hence the caller is still able
+     to report success or failure per sensor point.
+
+    Background work of the engine (the scan of nodes, commands to many
+     switches) is done by a fixed number of worker threads fed by a bounded
+     queue (PostWorkerPool), rather than starting a new thread for each item.
+
+    Every outbound payload is written to an on-disk spool (Spool) before it
+     is posted, and only dropped from the spool once BuildingDepot accepts
+     it. Payloads which fail to post are replayed in order by a background
+     drainer with backoff, hence network blips do not lose data.
+
+    The payloads are posted by BDPublisher, which talks to the BuildingDepot
+     RESTful API over a pool of keep-alive connections (HTTPPool), instead of
+     opening a new connection (and TLS handshake) for each sensor point.
+     The access token is kept by TokenCache (in memory and on disk), which
+     renews it in background before it expires, so the token request is not
+     made for each post.
+
+    Alarm updates (e.g. motion) take a fast lane (AlarmLane) of their own:
+     reserved workers post each alarm at once over reserved connections,
+     without batching and without waiting behind the spool backlog, and the
+     latency from the signal to the acknowledgement of BuildingDepot is
+     recorded (LatencyStats). Alarms are written to the spool before they
+     take the lane, and the ones which fail are left to its drainer, so
+     they are never lost.
+"""
+
+DEFAULT_MAX_BATCH = 64          # max number of sensor points per payload
+DEFAULT_FLUSH_INTERVAL = 1.0    # max seconds a sensor point stays pending
+DEFAULT_WORKERS = 4             # number of posting worker threads
+DEFAULT_QUEUE_SIZE = 256        # max number of queued value updates
+
+# fast lane of alarms
+DEFAULT_ALARM_WORKERS = 2       # number of workers reserved for alarms
+DEFAULT_ALARM_QUEUE_SIZE = 64   # max number of alarms waiting for a worker
+DEFAULT_LATENCY_WINDOW = 1000   # number of latest latencies kept
+
+# spool defaults
+DEFAULT_SPOOL_PATH = "spool"            # directory of spool segments
+DEFAULT_SEGMENT_SIZE = 1024 * 1024      # bytes of a segment before rotation
+DEFAULT_SPOOL_MAX_BYTES = 64 * 1024 * 1024   # max bytes of all segments
+DEFAULT_FSYNC_BATCH = 64                # records written between fsync
+DEFAULT_FSYNC_INTERVAL = 1.0            # max seconds between fsync
+DEFAULT_BACKOFF_MIN = 1.0               # first retry delay of drainer
+DEFAULT_BACKOFF_MAX = 300.0             # max retry delay of drainer
+
+# result of a post
+POST_OK = "ok"              # accepted by BuildingDepot
+POST_RETRY = "retry"        # temporary failure, need be retried
+POST_REJECT = "reject"      # permanent failure, retry will never succeed
+
+# BuildingDepot RESTful api
+DEFAULT_HTTP_TIMEOUT = 10.0     # seconds of connect/read timeout
+BD_TOKEN_PATH = "/oauth/access_token/client_id={}/client_secret={}"
+BD_SEARCH_PATH = "/api/search"
+BD_SENSOR_PATH = "/api/sensor"
+BD_TAGS_PATH = "/api/sensor/{}/tags"
+BD_TIMESERIES_PATH = "/api/sensor/timeseries"
+
+# cache of oauth access token
+DEFAULT_TOKEN_PATH = "bd_token.json"
+DEFAULT_TOKEN_LIFETIME = 3600.0     # seconds, if reply has no expires_in
+DEFAULT_REFRESH_BEFORE = 300.0      # refresh seconds before token expires
+DEFAULT_REFRESH_RETRY = 30.0        # seconds between failed refreshes
+
+
+def point_name(sdata):
+    """
+        get the source name of a sensor point
+
+        Args: sdata the sensor point dict
+        Return: the key of the sensor point which is not mac_id
+    """
+    for k in sdata:
+        if k != "mac_id":
+            return k
+    return sdata.get("mac_id", "")
+
+def split_response(response, batch):
+    """
+        split the response of a batched post into status of each point.
+
+        Args:
+            response: the response returned by get_json
+            batch: the list of sensor points that have been posted
+        Return: list of status string, one for each sensor point. If the
+            response is a list matching the batch, each point gets its own
+            item, otherwise the response applies to every point of the batch
+    """
+    if isinstance(response, list) and len(response) == len(batch):
+        return [str(r) for r in response]
+    return [str(response)] * len(batch)
+
+class BatchPublisher:
+    """
+        Class of BatchPublisher: the instance of this class collects sensor
+        points and posts them to BuildingDepot in batches.
+
+        A batch is posted once it reaches max_batch sensor points, or once
+        the oldest pending point has waited flush_interval seconds. Call
+        flush() at the end of a scan to post the remaining points.
+
+        If an emit routine is given, the status line of each point is passed
+        to it as soon as its batch is posted (instead of being kept until
+        report()), hence the result of a large scan is streamed to the client.
+
+        A batch may be posted by the flush timer while the caller flushes, 
+        hence flush() and report() wait for all batches in flight, so that 
+        no status is recorded (or emitted) after they return.
+
+        Only a post routine which accepts a list of sensor points and replies 
+        the status of each point (batched, e.g. BDPublisher.post) is given 
+        whole batches. Other routines (e.g. get_json) get one payload per 
+        sensor point, as before batching.
+    """
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, \
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, post=get_json, \
+                 emit=None, batched=False):
+        """
+            Args:
+                max_batch: max number of sensor points in one payload
+                flush_interval: max seconds a sensor point can be pending
+                post: routine used to post the json string of a payload
+                emit: routine called with each status line, None to keep the
+                    status lines for report()
+                batched: True if post accepts a list of sensor points and 
+                    replies a list of status, one per point
+            Return: None
+        """
+        self.max_batch = max(1, int(max_batch))
+        self.flush_interval = float(flush_interval)
+        self.post = post
+        self.emit = emit
+        self.batched = batched
+        self.lock = threading.Condition()
+        self.inflight = 0            # number of batches being posted
+        self.tail = None             # last point of the latest taken batch
+        self.pending = []
+        self.results = []            # (source name, status) of each point
+        self.tags = {}               # id of pending point -> tag
+        self.notes = {}              # id of pending point -> notes after it
+        self.timer = None
+        self.batches = 0             # number of posted payloads
+
+    def add(self, sdata, tag=""):
+        """
+            add one sensor point, post the batch if it is full.
+
+            Args:
+                sdata: the sensor point dict
+                tag: note appended to the source name in status string
+            Return: None
+        """
+        batch = []
+        with self.lock:
+            self.tags[id(sdata)] = tag
+            self.pending.append(sdata)
+            if len(self.pending) >= self.max_batch:
+                batch = self.take()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if batch:
+            self.post_batch(batch)
+
+    def take(self):
+        """
+            take all pending points out, must be called with lock held. The 
+            batch is in flight until post_batch records its status.
+
+            Return: list of pending sensor points
+        """
+        batch = self.pending
+        self.pending = []
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if batch:
+            self.inflight += 1
+            self.tail = batch[-1]
+        return batch
+
+    def post_batch(self, batch):
+        """
+            post a batch of sensor points and record status of each point.
+
+            Args: batch list of sensor points taken by take()
+            Return: None
+        """
+        status = ["Error in posting data"] * len(batch)
+        try:
+            if self.batched:
+                status = split_response(self.send(batch), batch)
+            else:
+                status = [str(self.send(sdata)) for sdata in batch]
+        finally:
+            with self.lock:
+                self.batches += 1
+                for sdata, st in zip(batch, status):
+                    self.record(point_name(sdata) + \
+                        self.tags.pop(id(sdata), ""), st)
+                    for name, note in self.notes.pop(id(sdata), []):
+                        self.record(name, note)
+                if self.tail is batch[-1]:
+                    self.tail = None
+                self.inflight -= 1
+                self.lock.notify_all()
+
+    def send(self, sensor_data):
+        """
+            post one payload of a sensor point or a list of sensor points.
+
+            Return: the response, or the error string if posting raised
+        """
+        try:
+            return self.post(json.dumps({"sensor_data": sensor_data, \
+                "time": time.time()}))
+        except Exception as e:
+            return "Error in posting data: " + str(e)
+
+    def record(self, name, status):
+        """
+            keep or emit the status of one point, must be called with lock 
+            held, so that the lines are emitted in the order of results.
+        """
+        if self.emit is None:
+            self.results.append((name, status))
+        else:
+            self.emit("{} : {}\n".format(name, status))
+
+    def note(self, name, status):
+        """
+            record a status line which is not a posted sensor point, e.g. a 
+            node skipped by the scan. The line follows the status of points 
+            added before it.
+
+            Args:
+                name: name shown in status string
+                status: the status
+            Return: None
+        """
+        with self.lock:
+            last = self.pending[-1] if self.pending else self.tail
+            if last is not None:
+                self.notes.setdefault(id(last), []).append((name, status))
+            else:
+                self.record(name, status)
+
+    def flush(self):
+        """
+            post all pending points, and wait for the batches in flight.
+
+            Return: list of (source name, status) of all points posted so 
+                far, which is empty if status lines are emitted
+        """
+        with self.lock:
+            batch = self.take()
+        if batch:
+            self.post_batch(batch)
+        with self.lock:
+            while self.inflight:
+                self.lock.wait()
+            return list(self.results)
+
+    def report(self):
+        """
+            flush pending points and build the status string of all points.
+
+            Return: one line per sensor point "<source name> : <status>", 
+                or "" if status lines are emitted
+        """
+        return "".join("{} : {}\n".format(name, st) \
+            for name, st in self.flush())
+
+class PostWorkerPool:
+    """
+        Class of PostWorkerPool: a fixed number of worker threads fed by a 
+        bounded queue. Each queued item is handed to the handler routine by 
+        one of the workers. Once the queue is full, the caller waits until 
+        there is room in the queue.
+    """
+    def __init__(self, handler, workers=DEFAULT_WORKERS, \
+                 queue_size=DEFAULT_QUEUE_SIZE, name="post"):
+        """
+            Args:
+                handler: routine called by workers with each queued item
+                workers: number of worker threads
+                queue_size: max number of items in the queue
+                name: name of pool used in thread names and reports
+            Return: None
+        """
+        self.handler = handler
+        self.queue_size = max(1, int(queue_size))
+        self.name = name
+        self.cond = threading.Condition()
+        self.queue = collections.deque()   # queued items
+        self.running = True
+        # counters
+        self.queued = 0
+        self.processed = 0
+        self.failed = 0
+        self.workers = []
+        for i in range(0, max(1, int(workers))):
+            th = threading.Thread(target=self.work, \
+                name="{}-worker-{}".format(name, i))
+            th.daemon = True
+            self.workers.append(th)
+            th.start()
+
+    def submit(self, item):
+        """
+            put an item into the queue, wait for room if it is full.
+
+            Args: item the item handed to handler
+            Return: True if the item is queued, False if the pool is stopped
+        """
+        with self.cond:
+            while self.running and len(self.queue) >= self.queue_size:
+                self.cond.wait()
+            if not self.running:
+                return False
+            self.queue.append(item)
+            self.queued += 1
+            self.cond.notify_all()
+            return True
+
+    def work(self):
+        """
+            worker routine: take items from the queue and process them.
+        """
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return                   # stopped and drained
+                item = self.queue.popleft()
+                self.cond.notify_all()
+            try:
+                self.handler(item)
+                ok = True
+            except Exception as e:
+                print("ERROR: [{}] {}".format(self.name, e))
+                ok = False
+            with self.cond:
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def stop(self, timeout=None):
+        """
+            stop accepting items, and wait for the workers to drain the 
+            queue.
+
+            Args: timeout max seconds to wait for each worker
+            Return: None
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for th in self.workers:
+            th.join(timeout)
+
+    def stats(self):
+        """
+            Return: dict of counters of the pool
+        """
+        with self.cond:
+            return {"queued": self.queued, "processed": self.processed, \
+                "failed": self.failed, "backlog": len(self.queue), \
+                "workers": len(self.workers)}
+
+    def report(self):
+        """
+            Return: status string of the pool counters
+        """
+        st = self.stats()
+        return "{} pool: ".format(self.name) + ", ".join( \
+            "{} = {}".format(k, st[k]) for k in sorted(st)) + "\n"
+
+class LatencyStats:
+    """
+        Class of LatencyStats: the latest latencies of an operation, which 
+        are summarized as count, average, percentiles and max.
+    """
+    def __init__(self, window=DEFAULT_LATENCY_WINDOW):
+        """
+            Args: window number of latest latencies kept
+            Return: None
+        """
+        self.lock = threading.Lock()
+        self.samples = collections.deque(maxlen=max(1, int(window)))
+        self.count = 0
+
+    def add(self, seconds):
+        """
+            record one latency in seconds.
+        """
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def stats(self):
+        """
+            Return: dict of count and latencies (in milliseconds) of the 
+            latest window
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+            count = self.count
+        if not samples:
+            return {"count": count}
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+        return {"count": count, \
+            "avg_ms": round(1000.0 * sum(samples) / len(samples), 1), \
+            "p50_ms": round(1000.0 * percentile(0.50), 1), \
+            "p95_ms": round(1000.0 * percentile(0.95), 1), \
+            "max_ms": round(1000.0 * samples[-1], 1)}
+
+class AlarmLane:
+    """
+        Class of AlarmLane: the fast lane of alarm updates.
+
+        A fixed number of workers reserved for alarms take each alarm as 
+        soon as it is submitted, write (and sync) it to the spool, so that 
+        it survives a crash or restart, and post it, neither batched nor 
+        queued behind the backlog of spool, hence a motion event is never 
+        stuck behind a scan. The latency from the receipt of signal to the 
+        acknowledgement of BuildingDepot is recorded for each alarm.
+
+        The caller (the signal handler) only queues the alarm in memory, it 
+        neither writes the spool nor waits for a worker. Alarms beyond 
+        queue_size are spilled to the spool by the next free worker, with a 
+        single sync, and left to the drainer of spool, as are the alarms 
+        which BuildingDepot does not accept; the drainer retries them until 
+        they are accepted.
+    """
+    def __init__(self, post, spool, workers=DEFAULT_ALARM_WORKERS, \
+                 queue_size=DEFAULT_ALARM_QUEUE_SIZE, \
+                 window=DEFAULT_LATENCY_WINDOW):
+        """
+            Args:
+                post: routine posting a sensor_data payload (json string)
+                spool: the instance of Spool keeping the alarms
+                workers: number of worker threads
+                queue_size: max number of alarms waiting for a worker
+                window: number of latest latencies kept
+            Return: None
+        """
+        self.post = post
+        self.spool = spool
+        self.queue_size = max(1, int(queue_size))
+        self.cond = threading.Condition()
+        self.queue = collections.deque()   # (payload, received)
+        self.running = True
+        self.latency = LatencyStats(window)
+        # counters
+        self.accepted = 0
+        self.spilled = 0
+        self.failed = 0
+        self.rejected = 0
+        self.workers = []
+        for i in range(0, max(1, int(workers))):
+            th = threading.Thread(target=self.work, \
+                name="alarm-lane-{}".format(i))
+            th.daemon = True
+            self.workers.append(th)
+            th.start()
+
+    def submit(self, payload, received=None):
+        """
+            hand an alarm to the lane, it neither writes the spool nor 
+            waits for a worker.
+
+            Args:
+                payload: the sensor_data payload dict
+                received: time the signal of alarm was received, now if it 
+                    is None
+            Return: None
+        """
+        if received is None:
+            received = time.time()
+        payload = json.dumps(payload)
+        with self.cond:
+            if self.running:
+                self.queue.append((payload, received))
+                self.cond.notify()
+                return
+            self.spilled += 1
+        self.spool.spill([payload])          # lane stopped
+
+    def work(self):
+        """
+            worker routine: spill the alarms beyond queue_size, and post 
+            alarms one by one.
+        """
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return                   # stopped and drained
+                spill = []
+                while len(self.queue) > self.queue_size:
+                    spill.append(self.queue.pop()[0])
+                self.spilled += len(spill)
+                payload, received = self.queue.popleft()
+            if spill:
+                self.spool.spill(reversed(spill))
+            seq = self.spool.reserve(payload)
+            response, result = self.spool.deliver(seq, payload, self.post)
+            if result == POST_OK:
+                self.latency.add(time.time() - received)
+                with self.cond:
+                    self.accepted += 1
+                continue
+            print("WARN: [alarm lane] {}, {}".format(response, \
+                "left to spool" if result == POST_RETRY else "rejected"))
+            with self.cond:
+                if result == POST_RETRY:
+                    self.failed += 1
+                else:
+                    self.rejected += 1
+
+    def stop(self, timeout=None):
+        """
+            stop accepting alarms, and wait for the workers to post the 
+            queued ones.
+
+            Args: timeout max seconds to wait for each worker
+            Return: None
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for th in self.workers:
+            th.join(timeout)
+
+    def stats(self):
+        """
+            Return: dict of counters and latencies of the lane
+        """
+        with self.cond:
+            st = {"accepted": self.accepted, "spilled": self.spilled, \
+                "failed": self.failed, "rejected": self.rejected, \
+                "backlog": len(self.queue), "workers": len(self.workers)}
+        for k, v in self.latency.stats().items():
+            if k != "count":
+                st["latency_" + k] = v
+        return st
+
+    def report(self):
+        """
+            Return: status string of the lane counters and latencies
+        """
+        st = self.stats()
+        return "alarm lane: " + ", ".join("{} = {}".format(k, st[k]) \
+            for k in sorted(st)) + "\n"
+
+def classify(response):
+    """
+        classify the response of a post.
+
+        Args: response the response returned by get_json or BDPublisher 
+            (or the error string if posting raised)
+        Return: POST_OK, POST_RETRY or POST_REJECT. A response with an 
+            "HTTP Error 4xx" (except 401, 408 and 429) is rejected, other 
+            errors are retried.
+    """
+    if isinstance(response, list):
+        results = set(classify(r) for r in response)
+        for result in (POST_RETRY, POST_REJECT):
+            if result in results:
+                return result
+        return POST_OK
+    if isinstance(response, dict) and "success" in response:
+        if str(response["success"]).lower() == "true":
+            return POST_OK
+    text = str(response)
+    match = re.search(r"HTTP Error (\d+)", text)
+    if match:
+        code = int(match.group(1))
+        if 400 <= code < 500 and code not in (401, 408, 429):
+            return POST_REJECT
+        return POST_RETRY
+    if "error" in text.lower() or "false" in text.lower():
+        return POST_RETRY
+    return POST_OK
+
+def classify_points(payload, response):
+    """
+        classify the response of a multi-point payload point by point.
+
+        Args:
+            payload: the json string of sensor_data payload
+            response: the response of posting it
+        Return: list of the result of each sensor point, or None if the 
+            payload is not a list of sensor points or the response is not a 
+            list of status matching it
+    """
+    if not isinstance(response, list):
+        return None
+    try:
+        points = json.loads(payload)["sensor_data"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(points, list) or len(points) != len(response):
+        return None
+    return [classify(r) for r in response]
+
+class Spool:
+    """
+        Class of Spool: an append-only on-disk spool which every outbound 
+        payload passes through.
+
+        The spool is a directory of segment files, each line of a segment 
+        being either a record or an acknowledgement:
+            R <seq> <payload>
+            A <seq>
+        A payload is written as a record before it is posted, and an 
+        acknowledgement is written once it is accepted (or rejected for 
+        good). The points of a multi-point payload are settled one by one: 
+        if only some of them are to be retried, the record is acknowledged 
+        and a new record of those points is left to the drainer, so that the 
+        accepted points are never posted twice. Records are fsync'ed in 
+        batches (fsync_batch records or 
+        fsync_interval seconds). A segment is deleted once all records in 
+        it and in older segments are acknowledged.
+
+        If there is no backlog, the caller posts the payload directly. 
+        Otherwise, or if the post fails, the payload is left to a single 
+        background drainer which replays the records in order, with 
+        exponential backoff and jitter between failed attempts. Once the 
+        spool exceeds max_bytes, the oldest segment is evicted and the 
+        number of lost records is counted and printed.
+
+        Unacknowledged records are replayed after an engine restart.
+    """
+    def __init__(self, sender=get_json, path=DEFAULT_SPOOL_PATH, \
+                 segment_size=DEFAULT_SEGMENT_SIZE, \
+                 max_bytes=DEFAULT_SPOOL_MAX_BYTES, \
+                 fsync_batch=DEFAULT_FSYNC_BATCH, \
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, \
+                 backoff_min=DEFAULT_BACKOFF_MIN, \
+                 backoff_max=DEFAULT_BACKOFF_MAX):
+        """
+            Args:
+                sender: routine posting the json string of a payload
+                path: directory of segment files
+                segment_size: bytes of a segment before a new one is started
+                max_bytes: max bytes of all segments
+                fsync_batch: max records written between two fsync
+                fsync_interval: max seconds between two fsync
+                backoff_min: first retry delay of drainer in seconds
+                backoff_max: max retry delay of drainer in seconds
+            Return: None
+        """
+        self.sender = sender
+        self.path = path
+        self.segment_size = int(segment_size)
+        self.max_bytes = int(max_bytes)
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.fsync_interval = float(fsync_interval)
+        self.backoff_min = float(backoff_min)
+        self.backoff_max = float(backoff_max)
+        self.cond = threading.Condition()
+        self.segments = collections.OrderedDict()  # name -> [bytes, open]
+        self.location = {}       # seq of unacked record -> segment name
+        self.payloads = {}       # seq of backlog record -> payload
+        self.backlog = []        # heap of seq left to drainer
+        self.active = None       # file object of active segment
+        self.active_name = None
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.next_seq = 1
+        self.running = True
+        self.replaying = False   # drainer is posting a record
+        self.stopping = threading.Event()
+        # counters
+        self.spooled = 0
+        self.acked = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.retries = 0
+        self.split = 0           # records whose points were settled apart
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.recover()
+        self.drainer = threading.Thread(target=self.drain, name="spool")
+        self.drainer.daemon = True
+        self.drainer.start()
+
+    def recover(self):
+        """
+            load segments left by last run, unacked records become backlog.
+        """
+        records = {}
+        acked = set()
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".seg"):
+                continue
+            full = os.path.join(self.path, name)
+            self.segments[name] = [os.path.getsize(full), 0]
+            with open(full) as f:
+                for line in f:
+                    parts = line.rstrip("\n").split(" ", 2)
+                    try:
+                        seq = int(parts[1])
+                    except (IndexError, ValueError):
+                        continue            # torn line of a crash
+                    if parts[0] == "R" and len(parts) == 3:
+                        records[seq] = (name, parts[2])
+                    elif parts[0] == "A":
+                        acked.add(seq)
+                    self.next_seq = max(self.next_seq, seq + 1)
+        for seq, (name, payload) in records.items():
+            if seq not in acked:
+                self.location[seq] = name
+                self.payloads[seq] = payload
+                self.segments[name][1] += 1
+                heapq.heappush(self.backlog, seq)
+        self.collect()
+        if self.backlog:
+            print("INFO: spool recovered {} payloads".format(len(self.backlog)))
+
+    def open_segment(self):
+        """
+            start a new active segment, must be called with lock held.
+        """
+        if self.active is not None:
+            self.sync(True)
+            self.active.close()
+        self.active_name = "{:020d}.seg".format(self.next_seq)
+        self.active = open(os.path.join(self.path, self.active_name), "a")
+        self.segments[self.active_name] = [0, 0]
+
+    def write(self, line):
+        """
+            append a line to active segment, must be called with lock held.
+        """
+        if self.active is None or \
+           self.segments[self.active_name][0] >= self.segment_size:
+            self.open_segment()
+        self.active.write(line)
+        self.segments[self.active_name][0] += len(line)
+        self.unsynced += 1
+        self.sync()
+
+    def sync(self, force=False):
+        """
+            fsync active segment once enough records are written or enough 
+            time passed, must be called with lock held.
+        """
+        if self.active is None or self.unsynced == 0:
+            return
+        if force or self.unsynced >= self.fsync_batch or \
+           time.time() - self.last_sync >= self.fsync_interval:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.unsynced = 0
+            self.last_sync = time.time()
+
+    def append(self, payload):
+        """
+            write a record, must be called with lock held.
+
+            Return: seq of the record
+        """
+        seq = self.next_seq
+        self.write("R {} {}\n".format(seq, payload))
+        self.next_seq += 1
+        self.location[seq] = self.active_name
+        self.segments[self.active_name][1] += 1
+        self.spooled += 1
+        self.evict()
+        return seq
+
+    def ack(self, seq):
+        """
+            acknowledge a record, must be called with lock held.
+        """
+        name = self.location.pop(seq, None)
+        self.payloads.pop(seq, None)
+        if name is None:
+            return                          # evicted meanwhile
+        self.write("A {}\n".format(seq))
+        self.segments[name][1] -= 1
+        self.collect()
+
+    def collect(self):
+        """
+            delete the oldest segments whose records are all acknowledged, 
+            must be called with lock held.
+        """
+        while self.segments:
+            name, (size, unacked) = next(iter(self.segments.items()))
+            if unacked > 0 or name == self.active_name:
+                return
+            self.remove_segment(name)
+
+    def remove_segment(self, name):
+        """
+            delete a segment file, must be called with lock held.
+        """
+        del self.segments[name]
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+            evict the oldest segments once the spool exceeds max_bytes, must 
+            be called with lock held.
+        """
+        while sum(size for size, unacked in self.segments.values()) > \
+              self.max_bytes and len(self.segments) > 1:
+            name = next(iter(self.segments))
+            if name == self.active_name:
+                self.open_segment()
+                continue
+            lost = [seq for seq, n in self.location.items() if n == name]
+            for seq in lost:
+                del self.location[seq]
+                self.payloads.pop(seq, None)
+            self.evicted += len(lost)
+            if lost:
+                print("WARN: spool full, evicted {} payloads".format(len(lost)))
+            self.remove_segment(name)
+
+    def post(self, payload):
+        """
+            spool a payload and post it. The payload is posted by the caller 
+            if there is no backlog, otherwise it is left to the drainer.
+
+            Args: payload the json string to post
+            Return: the response, or a status string if the payload is left 
+                in the spool
+        """
+        with self.cond:
+            seq = self.append(payload)
+            if self.backlog or self.replaying or not self.running:
+                self.queue(seq, payload)
+                return "Spooled: {} payloads waiting for BuildingDepot" \
+                    .format(len(self.backlog))
+        response, result = self.deliver(seq, payload)
+        if result != POST_RETRY:
+            return response
+        if isinstance(response, list):
+            return [r if classify(r) != POST_RETRY else \
+                "Spooled after failure: " + str(r) for r in response]
+        return "Spooled after failure: " + str(response)
+
+    def reserve(self, payload):
+        """
+            spool a payload the caller is going to post by itself (with 
+            deliver), the record is synced at once.
+
+            Args: payload the json string to post
+            Return: seq of the record
+        """
+        with self.cond:
+            seq = self.append(payload)
+            self.sync(True)
+            return seq
+
+    def deliver(self, seq, payload, sender=None):
+        """
+            post a spooled payload, which is acknowledged once accepted (or 
+            rejected), and otherwise left to the drainer.
+
+            Args:
+                seq: seq of the record
+                payload: the json string to post
+                sender: routine posting the payload, the sender of spool if 
+                    it is None
+            Return: (response, result of classify), the result is 
+                POST_RETRY if any point is left to the drainer
+        """
+        response, result = self.send(payload, sender)
+        with self.cond:
+            result = self.resolve(seq, payload, response, result)
+        return response, result
+
+    def spill(self, payloads):
+        """
+            spool payloads left to the drainer, the records are synced once.
+
+            Args: payloads the json strings to post
+            Return: None
+        """
+        with self.cond:
+            for payload in payloads:
+                self.queue(self.append(payload), payload)
+            self.sync(True)
+
+    def queue(self, seq, payload):
+        """
+            leave a record to the drainer, must be called with lock held.
+        """
+        if seq in self.location:
+            self.payloads[seq] = payload
+            heapq.heappush(self.backlog, seq)
+            self.cond.notify_all()
+
+    def settle(self, seq, result):
+        """
+            acknowledge a record which is posted or rejected, must be called 
+            with lock held.
+        """
+        if result == POST_REJECT:
+            self.rejected += 1
+            print("WARN: spool dropped payload {} rejected by BuildingDepot" \
+                .format(seq))
+        else:
+            self.acked += 1
+        self.ack(seq)
+
+    def resolve(self, seq, payload, response, result):
+        """
+            settle a posted record by its response, or leave it (or the 
+            points of it to be retried) to the drainer, must be called with 
+            lock held.
+
+            Args:
+                seq: seq of the record
+                payload: the json string posted
+                response: the response of posting it
+                result: classify() of the response
+            Return: result of the record, POST_RETRY if any point is left 
+                to the drainer
+        """
+        results = classify_points(payload, response)
+        if result != POST_RETRY or results is None or \
+           POST_RETRY not in results or set(results) == set([POST_RETRY]):
+            if result == POST_RETRY:
+                self.queue(seq, payload)
+            else:
+                self.settle(seq, result)
+            return result
+        data = json.loads(payload)
+        retry = [point for point, r in zip(data["sensor_data"], results) \
+            if r == POST_RETRY]
+        rejected = results.count(POST_REJECT)
+        if rejected:
+            self.rejected += rejected
+            print("WARN: spool dropped {} points of payload {} rejected by " \
+                "BuildingDepot".format(rejected, seq))
+        data["sensor_data"] = retry
+        rest = json.dumps(data)
+        self.queue(self.append(rest), rest)
+        self.split += 1
+        self.ack(seq)
+        return POST_RETRY
+
+    def send(self, payload, sender=None):
+        """
+            post a payload with sender, or the sender of spool if it is None.
+
+            Return: (response, result of classify)
+        """
+        try:
+            response = (sender or self.sender)(payload)
+        except Exception as e:
+            response = "Error in posting data: " + str(e)
+        return response, classify(response)
+
+    def drain(self):
+        """
+            drainer routine: replay backlog in order, back off after failure.
+        """
+        failures = 0
+        while True:
+            with self.cond:
+                while self.running and not self.backlog:
+                    self.cond.wait(self.fsync_interval)
+                    self.sync()
+                if not self.running:
+                    return
+                seq = heapq.heappop(self.backlog)
+                payload = self.payloads.get(seq)
+                if payload is None:
+                    continue                # evicted meanwhile
+                self.replaying = True
+            response, result = self.send(payload)
+            with self.cond:
+                self.replaying = False
+                result = self.resolve(seq, payload, response, result)
+                if result == POST_RETRY:
+                    self.retries += 1
+            if result == POST_RETRY:
+                failures += 1
+                delay = min(self.backoff_max, \
+                    self.backoff_min * (2 ** min(failures - 1, 30)))
+                delay = delay * random.uniform(0.5, 1.0)   # jitter
+                self.stopping.wait(delay)
+            else:
+                failures = 0
+
+    def stop(self):
+        """
+            stop the drainer and fsync the spool, the backlog is kept on 
+            disk and replayed at next start.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.stopping.set()
+        self.drainer.join()
+        with self.cond:
+            if self.active is not None:
+                self.sync(True)
+                self.active.close()
+                self.active = None
+
+    def stats(self):
+        """
+            Return: dict of counters of the spool
+        """
+        with self.cond:
+            return {"spooled": self.spooled, "acked": self.acked, \
+                "rejected": self.rejected, "evicted": self.evicted, \
+                "retries": self.retries, "split": self.split, "backlog": len(self.payloads), \
+                "segments": len(self.segments), "bytes": sum(size \
+                    for size, unacked in self.segments.values())}
+
+    def report(self):
+        """
+            Return: status string of the spool counters
+        """
+        st = self.stats()
+        return "spool: " + ", ".join("{} = {}".format(k, st[k]) \
+            for k in sorted(st)) + "\n"
+
+class HTTPError(Exception):
+    """
+        raised when BuildingDepot replies with an error status
+    """
+    def __init__(self, status, reason):
+        Exception.__init__(self, "HTTP Error {}: {}".format(status, reason))
+        self.status = status
+
+class HTTPPool:
+    """
+        Class of HTTPPool: a pool of keep-alive HTTP(S) connections.
+
+        Connections are kept open after each request and reused by the next 
+        request to the same host, hence the TCP and TLS handshakes are only 
+        paid once per connection instead of once per request. At most size 
+        idle connections are kept for each host, which should match the 
+        number of threads posting concurrently.
+    """
+    def __init__(self, size, timeout=DEFAULT_HTTP_TIMEOUT):
+        """
+            Args:
+                size: max number of idle connections kept for each host
+                timeout: connect/read timeout of each connection in seconds
+            Return: None
+        """
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.lock = threading.Lock()
+        self.idle = {}           # (scheme, host, port) -> idle connections
+        # counters
+        self.opened = 0
+        self.requests = 0
+        self.reused = 0
+        self.retried = 0
+
+    def acquire(self, key):
+        """
+            take an idle connection to the host, or open a new one.
+
+            Args: key (scheme, host, port)
+            Return: (connection, True if the connection is reused)
+        """
+        with self.lock:
+            if self.idle.get(key):
+                self.reused += 1
+                return self.idle[key].pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def release(self, key, conn):
+        """
+            give a connection back to the pool, close it if pool is full.
+        """
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+            send a request over a pooled connection. A reused connection may 
+            have been closed by the server meanwhile, in which case the 
+            request is sent once more over another connection. Only such a 
+            stale connection is retried (see stale()), a timeout or an error 
+            after the response started is raised, as the server may have 
+            processed the request.
+
+            Args:
+                method: HTTP method
+                url: full url of the request
+                body: request body string
+                headers: dict of request headers
+            Return: (status, response body string)
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+        while True:
+            conn, reused = self.acquire(key)
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if reused and self.stale(e):
+                    with self.lock:
+                        self.retried += 1
+                    continue
+                raise
+            try:
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                raise
+            with self.lock:
+                self.requests += 1
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(key, conn)
+            return response.status, data
+
+    @staticmethod
+    def stale(error):
+        """
+            tell if an error of sending a request over a reused connection 
+            means the server had closed the connection before, i.e. no byte 
+            of response arrived: the status line is empty, or the connection 
+            is reset or broken.
+
+            Args: error the exception raised by request() or getresponse()
+            Return: True if the request can be sent again safely
+        """
+        if isinstance(error, socket.timeout):
+            return False
+        if isinstance(error, httplib.BadStatusLine):
+            return not error.line.strip("'\"") or \
+                error.line.startswith("No status line received")
+        if isinstance(error, socket.error):
+            return getattr(error, "errno", None) in \
+                (errno.ECONNRESET, errno.EPIPE)
+        return False
+
+    def report(self):
+        """
+            Return: status string of the pool counters
+        """
+        st = self.stats()
+        return "http pool: " + ", ".join("{} = {}".format(k, st[k]) \
+            for k in sorted(st)) + "\n"
+
+    def close(self):
+        """
+            close all idle connections.
+        """
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def stats(self):
+        """
+            Return: dict of counters of the pool
+        """
+        with self.lock:
+            return {"opened": self.opened, "requests": self.requests, \
+                "reused": self.reused, "retried": self.retried, \
+                "idle": sum(len(c) for c in self.idle.values())}
+
+class TokenCache:
+    """
+        Class of TokenCache: the oauth access token of BuildingDepot, kept in 
+        memory and in a file so that it survives an engine restart.
+
+        A background thread requests a new token refresh_before seconds 
+        before the token expires, hence posting never waits for the token 
+        endpoint unless the token is missing or was refused (HTTP 401). 
+        The token is requested without the lock held, so callers keep 
+        getting the current token while a new one is requested.
+    """
+    def __init__(self, fetch, client_id, path=DEFAULT_TOKEN_PATH, \
+                 lifetime=DEFAULT_TOKEN_LIFETIME, \
+                 refresh_before=DEFAULT_REFRESH_BEFORE, \
+                 refresh_retry=DEFAULT_REFRESH_RETRY):
+        """
+            Args:
+                fetch: routine requesting a new token, returning (access 
+                    token, seconds to expire or None)
+                client_id: the client id the token belongs to
+                path: file the token is saved to, None to keep it in memory
+                lifetime: seconds a token lasts if expiry is not replied
+                refresh_before: seconds before expiry to request a new token
+                refresh_retry: seconds to wait after a failed refresh
+            Return: None
+        """
+        self.fetch = fetch
+        self.client_id = str(client_id)
+        self.path = path
+        self.lifetime = float(lifetime)
+        self.refresh_before = float(refresh_before)
+        self.refresh_retry = float(refresh_retry)
+        self.cond = threading.Condition()
+        self.access_token = None
+        self.issued_at = 0.0
+        self.expires_at = 0.0
+        self.fetching = False    # a new token is being requested
+        self.running = True
+        # counters
+        self.requested = 0
+        self.refused = 0
+        self.failed = 0
+        self.load()
+        self.refresher = threading.Thread(target=self.refresh_loop, \
+            name="token")
+        self.refresher.daemon = True
+        self.refresher.start()
+
+    def load(self):
+        """
+            load the saved token, if it belongs to the same client and has 
+            not expired.
+        """
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            if str(saved["client_id"]) == self.client_id and \
+                float(saved["expires_at"]) > time.time():
+                self.access_token = str(saved["access_token"])
+                self.issued_at = float(saved.get("issued_at", 0.0))
+                self.expires_at = float(saved["expires_at"])
+        except (IOError, ValueError, KeyError) as e:
+            print("Error in loading token: " + str(e))
+
+    def save(self):
+        """
+            save the token to file, must be called with lock held. The file 
+            is only readable by owner and is replaced atomically.
+        """
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"client_id": self.client_id, \
+                    "access_token": self.access_token, \
+                    "issued_at": self.issued_at, \
+                    "expires_at": self.expires_at}, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            print("Error in saving token: " + str(e))
+
+    def valid(self, now=None):
+        """
+            Return: True if there is a token which has not expired
+        """
+        now = time.time() if now is None else now
+        return self.access_token is not None and now < self.expires_at
+
+    def refresh(self):
+        """
+            request a new token, must be called without lock held by the 
+            caller which set fetching. The lock is only taken to swap in 
+            the new token.
+        """
+        try:
+            token, expires = self.fetch()
+        except Exception:
+            with self.cond:
+                self.requested += 1
+                self.fetching = False
+                self.cond.notify_all()
+            raise
+        with self.cond:
+            self.requested += 1
+            self.access_token = token
+            self.issued_at = time.time()
+            self.expires_at = self.issued_at + \
+                (expires if expires else self.lifetime)
+            self.save()
+            self.fetching = False
+            self.cond.notify_all()
+
+    def get(self):
+        """
+            Return: a valid access token. A new token is requested (once, 
+            by the first caller) if there is none, the other callers wait 
+            for it.
+        """
+        with self.cond:
+            while not self.valid():
+                if not self.fetching:
+                    self.fetching = True
+                    break
+                self.cond.wait()
+            else:
+                return self.access_token
+        self.refresh()
+        with self.cond:
+            return self.access_token
+
+    def invalidate(self, token):
+        """
+            drop a token refused by BuildingDepot. A token already replaced 
+            by another caller is left alone, hence concurrent 401 only 
+            request one new token.
+
+            Args: token the refused access token
+            Return: None
+        """
+        with self.cond:
+            self.refused += 1
+            if self.access_token == token:
+                self.access_token = None
+                self.expires_at = 0.0
+
+    def refresh_loop(self):
+        """
+            refresher routine: renew the token refresh_before seconds before 
+            it expires.
+        """
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                if self.access_token is None or self.fetching:
+                    self.cond.wait()       # first token is requested by get
+                    continue
+                # never renew before half of the token lifetime has passed
+                lead = min(self.refresh_before, \
+                    (self.expires_at - self.issued_at) / 2.0)
+                wait = self.expires_at - lead - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                self.fetching = True
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Error in refreshing token: " + str(e))
+                with self.cond:
+                    self.failed += 1
+                    if self.running:
+                        self.cond.wait(self.refresh_retry)
+
+    def stop(self):
+        """
+            stop the refresher, the token is kept on disk.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.refresher.join()
+
+    def stats(self):
+        """
+            Return: dict of counters of the token cache
+        """
+        with self.cond:
+            return {"requested": self.requested, "refused": self.refused, \
+                "failed": self.failed, \
+                "expires_in": int(max(0, self.expires_at - time.time()))}
+
+    def report(self):
+        """
+            Return: status string of the token cache counters
+        """
+        st = self.stats()
+        return "token: " + ", ".join("{} = {}".format(k, st[k]) \
+            for k in sorted(st)) + "\n"
+
+class BDPublisher:
+    """
+        Class of BDPublisher: post sensor_data payloads to BuildingDepot 
+        over a HTTPPool.
+
+        The uuid of the sensor of each sensor point is searched (and the 
+        sensor created if it does not exist) once and cached, and all sensor 
+        points of a payload are posted with one timeseries request.
+        The access token is taken from a TokenCache, and a request refused 
+        with HTTP 401 is sent once more with a new token.
+    """
+    def __init__(self, setting, pool, **token_options):
+        """
+            Args:
+                setting: dict of bd_setting.json
+                pool: the instance of HTTPPool
+                token_options: options of TokenCache (path, lifetime, 
+                    refresh_before, refresh_retry)
+            Return: None
+        """
+        self.setting = setting
+        self.pool = pool
+        url = str(setting["url"]).rstrip("/")
+        self.central = url + str(setting["oauth_port"])
+        self.data = url + str(setting["port"])
+        self.sensors = {}        # (mac id, source name) -> sensor uuid
+        self.tokens = TokenCache(self.request_token, setting["client_id"], \
+            **token_options)
+
+    def call(self, method, url, data=None):
+        """
+            send a json request to BuildingDepot.
+
+            Args:
+                method: HTTP method
+                url: full url of the request
+                data: object sent as json body, or None
+            Return: parsed json response
+        """
+        body = None if data is None else json.dumps(data)
+        for attempt in range(2):
+            token = self.tokens.get()
+            headers = {"Content-Type": "application/json", \
+                "Authorization": "bearer " + token}
+            status, text = self.pool.request(method, url, body, headers)
+            if status != 401:
+                break
+            self.tokens.invalidate(token)      # retry once with new token
+        if status >= 400:
+            raise HTTPError(status, text[:200])
+        try:
+            return json.loads(text)
+        except ValueError:
+            return {}
+
+    def request_token(self):
+        """
+            request a new access token from BuildingDepot.
+
+            Return: (access token, seconds to expire or None)
+        """
+        path = BD_TOKEN_PATH.format(self.setting["client_id"], \
+            self.setting["client_key"])
+        status, text = self.pool.request("GET", self.central + path)
+        if status >= 400:
+            raise HTTPError(status, text[:200])
+        reply = json.loads(text)
+        if "access_token" not in reply:
+            raise HTTPError(status, "no access token in reply")
+        expires = reply.get("expires_in")
+        return str(reply["access_token"]), \
+            (float(expires) if expires is not None else None)
+
+    def sensor_id(self, mac_id, src):
+        """
+            find the uuid of the sensor of a sensor point, the sensor is 
+            created if it does not exist.
+
+            Args:
+                mac_id: the mac id of the sensor point
+                src: the source name of the sensor point
+            Return: the uuid of sensor
+        """
+        key = (mac_id, src)
+        if key in self.sensors:
+            return self.sensors[key]
+        reply = self.call("POST", self.central + BD_SEARCH_PATH, \
+            {"data": {"Source_Name": [src], \
+                "Tags": ["{}:{}".format(self.setting["identity"], mac_id)]}})
+        found = reply.get("result") or []
+        if found:
+            uuid = str(found[0]["name"])
+        else:
+            reply = self.call("POST", self.central + BD_SENSOR_PATH, \
+                {"data": {"name": src, \
+                    "building": self.setting["building"], \
+                    "identifier": self.setting["identifier"]}})
+            uuid = str(reply["uuid"])
+            self.call("POST", self.central + BD_TAGS_PATH.format(uuid), \
+                {"data": [{"name": self.setting["identity"], \
+                    "value": mac_id}]})
+        self.sensors[key] = uuid
+        return uuid
+
+    def post(self, payload):
+        """
+            post a sensor_data payload, which can be used in place of 
+            get_json.
+
+            Args: payload the json string of sensor_data payload
+            Return: {"success": "True"} if sensor_data is a single sensor 
+                point, or a list of status of each sensor point, each being 
+                "success" or an error string
+        """
+        data = json.loads(payload)
+        points = data["sensor_data"]
+        single = isinstance(points, dict)
+        if single:
+            points = [points]
+        when = data.get("time", time.time())
+        status = []
+        samples = []
+        try:
+            self.tokens.get()
+        except Exception as e:
+            return self.result(single, ["Error in requesting token: " + \
+                str(e)] * len(points))
+        for point in points:
+            try:
+                for src, value in point.items():
+                    if src == "mac_id":
+                        continue
+                    samples.append({"sensor_id": \
+                        self.sensor_id(point["mac_id"], src), \
+                        "samples": [{"time": when, "value": value}]})
+                status.append("success")
+            except Exception as e:
+                status.append("Error in finding sensor: " + str(e))
+        if samples:
+            try:
+                self.call("POST", self.data + BD_TIMESERIES_PATH, \
+                    {"data": samples})
+            except Exception as e:
+                status = [st if st != "success" else \
+                    "Error in posting data: " + str(e) for st in status]
+        return self.result(single, status)
+
+    def over(self, pool):
+        """
+            get a publisher posting over another pool, which shares the 
+            access token and the cache of sensors with this one.
+
+            Args: pool the instance of HTTPPool
+            Return: instance of BDPublisher
+        """
+        publisher = copy.copy(self)
+        publisher.pool = pool
+        return publisher
+
+    def stop(self):
+        """
+            stop the token refresher.
+        """
+        self.tokens.stop()
+
+    @staticmethod
+    def result(single, status):
+        """
+            build the response of post().
+        """
+        if not single:
+            return status
+        if status[0] == "success":
+            return {"success": "True"}
+        return status[0]
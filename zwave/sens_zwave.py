@@ -8,6 +8,7 @@ import string
 import random
 import os
 from config.setting import Setting
+from frame import send_frame, recv_response, FrameError
 
 """
     About:
@@ -30,6 +31,10 @@ from config.setting import Setting
         python sens_zwave.py -r -1             # read all nodes of the network
         python sens_zwave.py -r 3              # read all sensors on node 3
         python sens_zwave.py -w 3 Switch on    # activate node 3 switch
+        python sens_zwave.py -S 2 Temperature  # follow updates of node 2
+        python sens_zwave.py -w 3 Switch off 4 Switch off  # many switches
+        python sens_zwave.py -A off            # switch all off
+        python sens_zwave.py -C activate night # activate scene 'night'
 
     The zwave network need be manully restarted in new network environment, 
     e.g. nodes are added/removed from network.
@@ -43,6 +48,7 @@ from config.setting import Setting
 """
 
 CONFIG = "zwave"         # zwave.json file
+TIMEOUT = 60.0           # default seconds to wait for engine response
 
 def socket_init():
     """
@@ -61,45 +67,61 @@ def socket_init():
     except Exception as e:
         sys.exit("Socket Creation Failed\n" + str(e))
 
-def recv_timeout(the_socket, timeout = 3):
+def print_response(the_socket, timeout = TIMEOUT):
     """
-        wrapper for receiving data from socket.
-      
+        print the response of engine as it arrives.
+
+        The engine streams the status of each sensor point as soon as it is 
+        posted, hence the progress of a large scan (e.g. -r -1) is shown, and 
+        the output can be piped into other tools line by line.
+
         Args: 
             the_socket: reference of the socket
-            time_out: specify the maximum time for data transmission
-        Return:
-            String for reponse information
+            time_out: specify the maximum time to wait for each frame
+        Return: None
     """
-    the_socket.setblocking(0)           # make socket non blocking
-    total_data=[];
-    data='';
-    begin=time.time()
-    while True:
-        if total_data and time.time()-begin > timeout * 2:
-            break
-        elif time.time()-begin > timeout:
-            break
-        try:
-            data = the_socket.recv(1024)
-            if data and not data.isspace():
-                total_data.append(data)
-                begin = time.time()    # update beginning time
-        except:
-            pass
-    return ''.join(total_data)
+    the_socket.settimeout(timeout)
+    last = "\n"
+    try:
+        for payload in recv_response(the_socket):
+            sys.stdout.write(payload)
+            sys.stdout.flush()
+            last = payload[-1:] or last
+    except socket.timeout:
+        sys.exit("Timeout in waiting for zwave network engine")
+    except FrameError as e:
+        sys.exit("Broken response of zwave network engine: " + str(e))
+    finally:
+        if last != "\n":
+            sys.stdout.write("\n")
 
 def usage(arguments):
     """
     usage infomation of the module
     """
-    print("usage: {} [-r node_id] [-w node_id label control] [-q] [-s] [-u]" \
+    print("usage: {} [-r node_id [max_age]] " \
+        "[-w node_id label control [node_id label control ...]] " \
+        "[-A on|off] [-C list|create|add|activate|remove ...] " \
+        "[-S [node_id [label [kind]]]] [-i] [-q] [-s] [-u]" \
         .format(arguments[0]))
-    print("    -r node_id: read sensed data from node with id being node_id, \
-        which is a positive integer larger than 1. If node_id is -1, all \
-        nodes will be scanned.")
+    print("    -r node_id [max_age]: read sensed data from node with id being \
+        node_id, which is a positive integer larger than 1. If node_id is -1, all \
+        nodes will be scanned. If max_age is given, only the sensor points \
+        updated within max_age seconds are published.")
     print("    -w node_id label control: send control command (on/off/toggle) \
-        to switch named 'label' on node specified by node id.")
+        to switch named 'label' on node specified by node id. Many switches \
+        can be controlled in one request by repeating node_id label control.")
+    print("    -A on|off: send switch all on/off to all nodes supporting it.")
+    print("    -C list|create label [node_id label data ...]|add scene \
+        node_id label data [...]|activate scene|remove scene: list, create, \
+        add values to, activate or remove scenes (by id or label), data is \
+        on/off for switches or a number.")
+    print("    -S [node_id [label [kind]]]: subscribe value updates, one json \
+        line is printed for each update as soon as it is received by the \
+        engine. Updates can be filtered by node id, label and kind of value \
+        (sensor, thermostat, battery, dimmer, rgbbulb, power_level, \
+        switch_all, protection or alarm), '*' matches any.")
+    print("    -i show statistics of zwave network engine.")
     print("    -s start zwave network engine.")
     print("    -q quit zwave network engine.")
     print("    -u show usage infomation.")
@@ -113,6 +135,11 @@ def main(arguments):
                               BuildingDepot stack 
                         '-w': Actuate the Zwave device Switch to switch on
                               and off.
+                        '-A': Switch all on/off.
+                        '-C': Manage and activate scenes.
+                        '-S': Print value updates pushed by ZwaveNetwork 
+                              engine until interrupted.
+                        '-i': Show statistics of ZwaveNetwork engine.
                         '-s': Start ZwaveNetwork engine.
                         '-q': Terminate ZwaveNetwork engine.
                         '-u': Print usage information.
@@ -131,8 +158,14 @@ def main(arguments):
     cmd = ""
     for arg in arguments[1:]:
         cmd = cmd + arg + " "
-    s.send(cmd)
-    print(recv_timeout(s).replace("\n", ""))        # print response
+    send_frame(s, cmd)
+    timeout = float(Setting(CONFIG).setting.get("timeout", TIMEOUT))
+    if arguments[1] == "-S":
+        timeout = None            # updates may be far apart
+    try:
+        print_response(s, timeout)    # print response as it arrives
+    except KeyboardInterrupt:
+        pass
     s.close()                     # close the socket when done
 
 if __name__ == "__main__":
@@ -15,6 +15,7 @@ import os
 import resource
 import openzwave
 import copy
+import threading
 from threading import Thread
 from openzwave.node import ZWaveNode
 from openzwave.value import ZWaveValue
@@ -23,6 +24,7 @@ from openzwave.controller import ZWaveController
 from openzwave.network import ZWaveNetwork
 from openzwave.option import ZWaveOption
 from louie import dispatcher, All
+from zwave_network import ListenFilter, NetworkStartup
 
 """
     About:
@@ -54,9 +56,9 @@ from louie import dispatcher, All
 CONFIG = "zwave"         # zwave.json file
 MAX_THREAD = 1
 threads = []
-listen = {}               # define the item to be listened
+listen = None             # define the item to be listened (ListenFilter)
 
-class ZwaveNetwork:
+class ZwaveNetwork(NetworkStartup):
     def __init__(self):
         """
             Initialize using zwave.json config file defined in CONFIG variable
@@ -65,12 +67,7 @@ class ZwaveNetwork:
         global listen
         global MAX_THREAD
         multisensor_cred = Setting(CONFIG)
-        self.device = str(multisensor_cred.setting["device"])
-        self.log = str(multisensor_cred.setting["log"])
-        self.log_file = str(multisensor_cred.setting["log_file"])
-        self.write_file = bool(multisensor_cred.setting["write_log_file"])
-        self.output_console = bool(multisensor_cred.setting["write_console"])
-
+        self.init_startup(multisensor_cred.setting)
         self.config = {}
         # format config dict
         for config_k, config_v in multisensor_cred.setting["config"].items():
@@ -78,71 +75,10 @@ class ZwaveNetwork:
             for k, v in config_v.iteritems():
                 item[int(k)] = int(v)   
             self.config[int(config_k)] = item
-        # format listen item
-        for k, v in multisensor_cred.setting["listen"].items():
-            item = []
-            for node in v:
-                item.append(str(node))
-            listen[int(k)] = item 
+        # compile listen item
+        listen = ListenFilter(multisensor_cred.setting["listen"])
         MAX_THREAD = int(multisensor_cred.setting["MAX_THREAD"])
 
-    def network_init(self):
-        """
-            Zwave network initialization.
-            Terminate program if initialization failed.
-        """
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger('openzwave')
-
-        # option initialization, abort if initialization failed
-        try:
-            options = ZWaveOption(self.device, \
-             config_path="../openzwave/config", \
-             user_path=".", cmd_line="")
-            options.set_log_file(self.log_file)
-            options.set_append_log_file(self.write_file)
-            options.set_console_output(self.output_console)
-            options.set_save_log_level(self.log)
-            options.set_logging(False)
-            options.lock()
-        except Exception as e:
-            print("Zwave initialization failed! \nPlease listen the USB port of zwave stick!")
-            print(e)
-            sys.exit(-1)
-
-        # create a network instance
-        self.network = ZWaveNetwork(options, log=None)
-
-    def network_awake(self):
-        """
-            Awake zwave network.
-            Terminated program if awake failed! """
-        print("INFO: Waiting for network awaked : ")
-
-        for i in range(0,300):
-            if self.network.state >= self.network.STATE_AWAKED:
-                break
-            else:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                time.sleep(1.0)
-
-        if self.network.state < self.network.STATE_AWAKED:
-            sys.exit("Network is not awake, program abort!")
-
-        for i in range(0,300):
-            if self.network.state >= self.network.STATE_READY:
-                break
-            else:
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                time.sleep(1.0)
-
-        if not self.network.is_ready:
-            sys.exit("Network is not ready, program abort!")
-        print("\nINFO: Network [{}] awaked!" .format(self.network.home_id_str))
-        print("INFO: Number of nodes: [{}]" .format(self.network.nodes_count))
-
     def config_node(self, node_id):
         """
             config a node specified by node id.
@@ -151,9 +87,9 @@ class ZwaveNetwork:
             Return: None
         """
         if node_id in self.config:
-            for k, v in self.config[node_id]:
+            for k, v in self.config[node_id].iteritems():
                 print("key = " + str(k) + " value = " + str(v))
-                self.networks.nodes[node_id].set_config_param(k, v)
+                self.network.nodes[node_id].set_config_param(k, v)
 
     def config_all_nodes(self):
         """
@@ -162,15 +98,8 @@ class ZwaveNetwork:
             Args: None
             Return: None
         """
-        for ndoe_id in self.network.nodes:
-            config_node(node_id)
-
-    def network_stop(self):
-        """
-            Stop network.
-        """
-        self.network.stop()
-        print("INFO: Network stopped")
+        for node_id in self.network.nodes:
+            self.config_node(node_id)
 
     def check_node_connection(self, node_id):
         """ 
@@ -241,10 +170,11 @@ def thread_post_bd(data):
     print(get_json(json.dumps(data)))   # has some issues here!
     thread_counter -= 1
 
-def louie_network_ready():
+def louie_network_ready(network):
     """
         initial signal handler
     """
+    listen.resolve(network)
     dispatcher.connect(louie_value_update, ZWaveNetwork.SIGNAL_VALUE)
 
 def louie_value_update(network, node, value):
@@ -253,8 +183,7 @@ def louie_value_update(network, node, value):
     """
     global MAX_THREAD
 
-    if node.node_id in listen \
-        and value.label in listen[node.node_id] \
+    if listen.accept(node.node_id, value) \
         and len(threads) < MAX_THREAD:
         data = {"sensor_data":{}}
         sdata = {}
@@ -284,10 +213,12 @@ def main(cmd):
     if cmd == '-r':
         # parse input args
         network = ZwaveNetwork()
-        network.network_init()
-        network.config_all_nodes()
+        # connected before the network is started, so that the ready signal 
+        # is not missed
         dispatcher.connect(louie_network_ready, ZWaveNetwork.SIGNAL_NETWORK_READY)
+        network.network_init()
         network.network_awake()
+        network.config_all_nodes()
 
         while True:
             time.sleep(1000)
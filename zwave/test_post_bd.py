@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import httplib
+import socket
+import unittest
+from post_bd import HTTPPool
+from bd_stub import start_stub
+
+"""
+    About:
+
+    This module tests the keep-alive connections of HTTPPool against the
+    BuildingDepot stub (bd_stub.py).
+
+    Usage:
+        python test_post_bd.py
+"""
+
+class HTTPPoolTest(unittest.TestCase):
+    """
+        Class of HTTPPoolTest: reuse and retry of pooled connections.
+    """
+    def setUp(self):
+        self.server = start_stub(0)
+        self.url = "http://127.0.0.1:{}/oauth/access_token/stub/stub" \
+            .format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        pool = HTTPPool(1)
+        for i in range(3):
+            status, data = pool.request("GET", self.url)
+            self.assertEqual(status, 200)
+        pool.close()
+        self.assertEqual(self.server.stats()["connections"], 1)
+        self.assertEqual(pool.stats()["reused"], 2)
+
+    def test_retry_stale(self):
+        pool = HTTPPool(1)
+        pool.request("GET", self.url)
+        self.server.drop = 1            # idle connection closed by server
+        status, data = pool.request("GET", self.url)
+        pool.close()
+        self.assertEqual(status, 200)
+        self.assertEqual(self.server.stats()["connections"], 2)
+        self.assertEqual(self.server.stats()["requests"], 3)
+        self.assertEqual(pool.stats()["retried"], 1)
+
+    def test_no_retry_new(self):
+        pool = HTTPPool(1)
+        self.server.drop = 1
+        self.assertRaises(httplib.HTTPException, pool.request, "GET", \
+            self.url)
+        self.assertEqual(self.server.stats()["requests"], 1)
+        self.assertEqual(pool.stats()["retried"], 0)
+
+    def test_no_retry_timeout(self):
+        pool = HTTPPool(1, timeout=0.2)
+        pool.request("GET", self.url)
+        self.server.delay = 0.5
+        self.assertRaises(socket.timeout, pool.request, "GET", self.url)
+        self.assertEqual(self.server.stats()["requests"], 2)
+        self.assertEqual(pool.stats()["retried"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
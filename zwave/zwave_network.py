@@ -3,16 +3,25 @@
 
 import json
 import time
+import numbers
 import sys
-from bd_connect.connect_bd import get_json
 from config.setting import Setting
+from frame import recv_frame, send_frame, send_end, HEADER
+from post_bd import BatchPublisher, PostWorkerPool, Spool, HTTPPool, \
+    BDPublisher, AlarmLane, DEFAULT_MAX_BATCH, DEFAULT_FLUSH_INTERVAL, \
+    DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_HTTP_TIMEOUT, \
+    DEFAULT_ALARM_WORKERS, DEFAULT_ALARM_QUEUE_SIZE
 import logging
 import os
 import resource
 import openzwave
-import copy
 import threading
 import socket
+import select
+import collections
+import contextlib
+import functools
+import Queue
 from openzwave.node import ZWaveNode
 from openzwave.value import ZWaveValue
 from openzwave.scene import ZWaveScene
@@ -46,7 +55,10 @@ from louie import dispatcher, All
     level and log file name(or path);
     b. the MAX_THREAD item defines the maximum number of thread that allows to 
     process concurrently;
-    c. the port item defines the port number by which this module will use to 
+    c. the publish item defines the batching of published sensor points, as 
+    well as the number of keep-alive connections used for posting them, and 
+    the alarm item defines the workers and queue of the alarm fast lane;
+    d. the port item defines the port number by which this module will use to 
     communicate with sens_zwave.py program;
 
     $ Set the file name/path in this program:
@@ -68,160 +80,2242 @@ from louie import dispatcher, All
 """
 
 CONFIG = "zwave"         # zwave.json file
+AWAKE_TIMEOUT = 300.0    # default seconds to wait for network awaked
+READY_TIMEOUT = 300.0    # default seconds to wait for network ready
+STALE_AFTER = 900.0      # default seconds after which a value is stale
+SERVER_THREAD = "thread" # front end: one thread per client connection
+SERVER_EVENT = "event"   # front end: one event loop for all connections
+SERVER_WORKERS = 8       # default number of command workers of event loop
+SCAN_WORKERS = 4         # default number of nodes scanned concurrently
+NODE_TIMEOUT = 30.0      # default seconds a scan waits for one node
+SUBSCRIBE_BUFFER = 256   # default updates buffered for each subscriber
+MAX_SUBSCRIBERS = 64     # default max number of subscribers
+KEEPALIVE = 5.0          # seconds between checks of an idle subscriber
+VERIFY_TIMEOUT = 5.0     # default seconds to wait for a switch to confirm
+PROBE_INTERVAL = 300.0   # default seconds between probes of node health
+WAKE_HISTORY = 32        # finished operations of sleeping nodes kept for -i
+POLL_INTERVAL = 30.0     # default seconds of one cycle of value polling
+POLL_ADJUST = 300.0      # default seconds between adjustments of polling
+POLL_MAX_BACKOFF = 8     # default max times a polling can be slowed down
+POLL_LOAD_WAIT = 1.0     # default avg wait (s) of scheduler of a busy mesh
+COALESCE_WINDOW = 0.2    # default seconds commands to a switch are merged
+ACTUATE_WORKERS = 4      # default number of workers sending multi -w
+TX_PER_SECOND = 10.0     # default budget of mesh transmissions per second
+TX_BURST = 5.0           # default transmissions allowed in a burst
+
+# priority classes of controller operations, lower goes first
+PRIORITY_ACTUATE = 0     # switch commands
+PRIORITY_ALARM = 1       # operations triggered by alarms
+PRIORITY_READ = 2        # reads of sensor points
+PRIORITY_CONFIG = 3      # configuration of nodes
+PRIORITY_NAMES = ["actuate", "alarm", "read", "config"]
+NODE_BROADCAST = 0xFF    # node id of operations sent to all nodes
+
+# switch commands of '-w' and the state they set, None to toggle
+SWITCH_COMMANDS = {"on": True, "off": False, "toggle": None}
 MAX_THREAD = 1
+
+# kinds of values, in the order the readers are applied during a scan
+LISTEN_ANY = "*"          # wildcard of node id or label in listen item
+
+KIND_SENSOR = "sensor"
+KIND_THERMOSTAT = "thermostat"
+KIND_BATTERY = "battery"
+KIND_DIMMER = "dimmer"
+KIND_RGBBULB = "rgbbulb"
+KIND_POWER_LEVEL = "power_level"
+KIND_SWITCH_ALL = "switch_all"
+KIND_PROTECTION = "protection"
+KIND_ALARM = "alarm"      # values of none of the non alarm kinds
+# node getter of each kind
+VALUE_KINDS = [(KIND_SENSOR, "get_sensors"), \
+    (KIND_THERMOSTAT, "get_thermostats"), \
+    (KIND_BATTERY, "get_battery_levels"), \
+    (KIND_DIMMER, "get_dimmers"), \
+    (KIND_RGBBULB, "get_rgbbulbs"), \
+    (KIND_POWER_LEVEL, "get_power_levels"), \
+    (KIND_SWITCH_ALL, "get_switches_all"), \
+    (KIND_PROTECTION, "get_protections")]
+# values of following kinds are not alarm type
+NON_ALARM_KINDS = frozenset([KIND_SENSOR, KIND_THERMOSTAT, KIND_BATTERY, \
+    KIND_DIMMER, KIND_RGBBULB, KIND_POWER_LEVEL, KIND_SWITCH_ALL, \
+    KIND_PROTECTION])
 threads = []             # thread pool
-listen = {}
+threads_lock = threading.Lock()
+alarm_lane = None        # fast lane posting alarms (AlarmLane)
+alarm_http_pool = None   # keep-alive connections reserved for alarms
+scan_pool = None         # worker pool scanning nodes for -r -1
+actuate_pool = None      # worker pool sending commands of multi -w
+spool = None             # on-disk spool of outbound payloads
+http_pool = None         # keep-alive connections to building depot
+bd_publisher = None      # posts payloads to building depot
+value_index = None       # value kind index of all nodes
+switch_index = None      # (node id, label) -> value id of switches
+switch_states = None     # last known state of each switch (SwitchStates)
+switch_commands = None   # coalescing of commands to switches
+scheduler = None         # scheduler of controller operations (MeshScheduler)
+node_health = None       # health of each node (NodeHealth)
+poll_schedule = None     # polling of values (PollSchedule)
+wake_queue = None        # operations waiting for nodes to wake up (WakeQueue)
+identities = None        # identity cache of sensor points
+snapshot = None          # latest value of each sensor point
+rules = None             # publishing rules (PublishRules)
+listen = None            # compiled listen filter (ListenFilter)
+subscriptions = None     # subscribers of value updates (Subscriptions)
+
+class NetworkStartup:
+    """
+        Class of NetworkStartup: the startup of zwave network shared by the 
+        engine and the debugging tools (check.py, sens_zwave_l.py), i.e. the 
+        options of openzwave, the startup signals, and the wait for the 
+        network awaked and ready.
+
+        A subclass calls init_startup() with the setting of zwave.json in 
+        its __init__, then network_init() and network_awake() once its own 
+        signal handlers are connected.
+    """
+    def init_startup(self, setting):
+        """
+            read the items of zwave.json used by the startup.
+
+            Args: setting the setting dict of zwave.json
+            Return: None
+        """
+        self.device = str(setting["device"])
+        self.log = str(setting["log"])
+        self.log_file = str(setting["log_file"])
+        self.write_file = bool(setting["write_log_file"])
+        self.output_console = bool(setting["write_console"])
+        # startup timeouts
+        self.awake_timeout = float(setting.get("awake_timeout", \
+            AWAKE_TIMEOUT))
+        self.ready_timeout = float(setting.get("ready_timeout", \
+            READY_TIMEOUT))
+        # startup events and timing
+        self.awaked = threading.Event()
+        self.ready = threading.Event()
+        self.failed = False
+        self.started = None
+        self.time_awaked = None
+        self.time_ready = None
+        self.node_queried = {}   # node id -> seconds to queries complete
+
+    def network_init(self):
+        """
+            Zwave network initialization.
+            Terminate program if initialization failed.
+        """
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger('openzwave')
+
+        # option initialization, abort if initialization failed
+        try:
+            options = ZWaveOption(self.device, \
+             config_path="../openzwave/config", \
+             user_path=".", cmd_line="")
+            options.set_log_file(self.log_file)
+            options.set_append_log_file(self.write_file)
+            options.set_console_output(self.output_console)
+            options.set_save_log_level(self.log)
+            options.set_logging(False)
+            options.lock()
+        except Exception as e:
+            print("Zwave initialization failed!")
+            print("Please check the USB port of Zwave Stick")
+            print(e)
+            sys.exit(-1)
+
+        # startup signals need be connected before the network is started
+        dispatcher.connect(self.louie_network_awaked, \
+            ZWaveNetwork.SIGNAL_NETWORK_AWAKED)
+        dispatcher.connect(self.louie_network_ready, \
+            ZWaveNetwork.SIGNAL_NETWORK_READY)
+        dispatcher.connect(self.louie_network_failed, \
+            ZWaveNetwork.SIGNAL_NETWORK_FAILED)
+        dispatcher.connect(self.louie_node_queries_complete, \
+            ZWaveNetwork.SIGNAL_NODE_QUERIES_COMPLETE)
+
+        # create a network instance
+        self.started = time.time()
+        self.network = ZWaveNetwork(options, log=None)
+
+    def louie_network_awaked(self, network):
+        """
+            signal handler when network is awaked
+        """
+        if self.time_awaked is None:
+            self.time_awaked = time.time() - self.started
+        self.awaked.set()
+
+    def louie_network_ready(self, network):
+        """
+            signal handler when network is ready
+        """
+        if self.time_awaked is None:
+            self.time_awaked = time.time() - self.started
+        if self.time_ready is None:
+            self.time_ready = time.time() - self.started
+        self.awaked.set()
+        self.ready.set()
+
+    def louie_network_failed(self, network):
+        """
+            signal handler when network is failed, wake up waiting thread
+        """
+        self.failed = True
+        self.awaked.set()
+        self.ready.set()
+
+    def louie_node_queries_complete(self, network, node):
+        """
+            signal handler when all queries of a node are completed
+        """
+        if node.node_id not in self.node_queried:
+            self.node_queried[node.node_id] = time.time() - self.started
+
+    def wait_state(self, event, state, timeout):
+        """
+            wait until the network reaches the state, or timeout.
+
+            Args:
+                event: the event set by signal handler of the state
+                state: the network state to reach
+                timeout: max seconds to wait
+            Return: True if the network reaches the state
+        """
+        if self.network.state < state:
+            event.wait(timeout)
+        return not self.failed and self.network.state >= state
+
+    def network_awake(self):
+        """
+            Awake zwave network.
+            Terminated program if awake failed! 
+        """
+        print("INFO: Waiting for network awaked :")
+        if not self.wait_state(self.awaked, self.network.STATE_AWAKED, \
+                self.awake_timeout):
+            sys.exit("Network is not awake, program abort!")
+
+        if not self.wait_state(self.ready, self.network.STATE_READY, \
+                self.ready_timeout) or not self.network.is_ready:
+            sys.exit("Network is not ready, program abort!")
+        print("INFO: Network [{}] awaked!" .format(self.network.home_id_str))
+        print("INFO: Number of nodes: [{}]" .format(self.network.nodes_count))
+        print(self.startup_report())
+
+    def startup_report(self):
+        """
+            build the report of startup timing, i.e. time to awake, time to 
+            ready and the time to complete queries of each node.
+
+            Args: None
+            Return: report string
+        """
+        def since(t):
+            return "pending" if t is None else "{:.2f} s".format(t)
+        report = "Startup timing:\n"
+        report += "    time to awake: {}\n".format(since(self.time_awaked))
+        report += "    time to ready: {}\n".format(since(self.time_ready))
+        for node_id in sorted(self.network.nodes):
+            report += "    node {} queries complete: {}\n" \
+                .format(node_id, since(self.node_queried.get(node_id)))
+        return report
+
+    def network_stop(self):
+        """
+            Stop network.
+        """
+        self.network.stop()
+        print("INFO: Network stopped")
+
+class ZwaveNetwork(NetworkStartup):
+    """
+        Class of zwavenetwork:
+        In the context of the instance of ZwaveNetwork the instance of zwave 
+        sensor and zwave actuator is able to proceeded.
+    """
+    def __init__(self):
+        """
+            Initialize using zwave.json config file defined in CONFIG variable
+        """
+        global MAX_THREAD
+        global listen
+        global rules
+        multisensor_cred = Setting(CONFIG)
+        self.init_startup(multisensor_cred.setting)
+        # format config dict
+        self.config = {}
+        for config_k, config_v in multisensor_cred.setting["config"].items():
+            item = {}
+            for k, v in config_v.iteritems():
+                item[int(k)] = int(v)   
+            self.config[int(config_k)] = item
+
+        listen = ListenFilter(multisensor_cred.setting["listen"])
+        rules = PublishRules(multisensor_cred.setting.get("rules", {}))
+
+        self.mapping  = {int(k): str(v) \
+            for k, v in multisensor_cred.setting["mapping"].iteritems()}
+        MAX_THREAD = int(multisensor_cred.setting["MAX_THREAD"])
+        # batching of published sensor points
+        publish = multisensor_cred.setting.get("publish", {})
+        self.max_batch = int(publish.get("max_batch", DEFAULT_MAX_BATCH))
+        self.flush_interval = float(publish.get("flush_interval", \
+            DEFAULT_FLUSH_INTERVAL))
+        self.post_workers = int(publish.get("workers", DEFAULT_WORKERS))
+        self.http_timeout = float(publish.get("timeout", DEFAULT_HTTP_TIMEOUT))
+        # fast lane of alarms
+        alarm = multisensor_cred.setting.get("alarm", {})
+        self.alarm_workers = int(alarm.get("workers", DEFAULT_ALARM_WORKERS))
+        self.alarm_queue_size = int(alarm.get("queue_size", \
+            DEFAULT_ALARM_QUEUE_SIZE))
+        # on-disk spool of outbound payloads
+        self.spool_options = dict((str(k), v) for k, v in \
+            multisensor_cred.setting.get("spool", {}).items())
+        # cache of building depot access token
+        self.token_options = dict((str(k), v) for k, v in \
+            multisensor_cred.setting.get("token", {}).items())
+        # front end serving sens_zwave.py
+        self.server = str(multisensor_cred.setting.get("server", \
+            SERVER_THREAD))
+        self.server_workers = int(multisensor_cred.setting.get( \
+            "server_workers", SERVER_WORKERS))
+        # concurrent scan of all nodes
+        scan = multisensor_cred.setting.get("scan", {})
+        self.scan_workers = int(scan.get("workers", SCAN_WORKERS))
+        self.node_timeout = float(scan.get("node_timeout", NODE_TIMEOUT))
+        # subscribers of value updates
+        subscribe = multisensor_cred.setting.get("subscribe", {})
+        self.subscribe_buffer = int(subscribe.get("buffer", SUBSCRIBE_BUFFER))
+        self.max_subscribers = int(subscribe.get("max_subscribers", \
+            MAX_SUBSCRIBERS))
+        # actuation of switches
+        actuate = multisensor_cred.setting.get("actuate", {})
+        self.verify = str(actuate.get("verify", "False")).lower() == "true"
+        self.verify_timeout = float(actuate.get("verify_timeout", \
+            VERIFY_TIMEOUT))
+        self.coalesce_window = float(actuate.get("window", COALESCE_WINDOW))
+        self.actuate_workers = int(actuate.get("workers", ACTUATE_WORKERS))
+        # scheduling of controller operations
+        schedule = multisensor_cred.setting.get("scheduler", {})
+        self.tx_per_second = float(schedule.get("tx_per_second", \
+            TX_PER_SECOND))
+        self.tx_burst = float(schedule.get("burst", TX_BURST))
+        # health of nodes
+        health = multisensor_cred.setting.get("health", {})
+        self.probe_interval = float(health.get("probe_interval", \
+            PROBE_INTERVAL))
+        # operations of sleeping nodes
+        wake = multisensor_cred.setting.get("wake", {})
+        self.wake_history = int(wake.get("history", WAKE_HISTORY))
+        # polling of values
+        self.poll = multisensor_cred.setting.get("poll", {})
+        # age of value after which it is flagged as stale
+        self.stale_after = float(multisensor_cred.setting.get("stale_after", \
+            STALE_AFTER))
+
+    def config_node(self, node_id):
+        """
+            config a node specified by node id.
+
+            Note: the parameters of a sleeping node are queued and pushed 
+            once it wakes up.
+
+            Args: node id of specific node
+            Return: None
+        """
+        if node_id in self.config:
+            for k, v in self.config[node_id].iteritems():
+                push = functools.partial(self.set_config_param, node_id, k, v)
+                if not wake_queue.defer(node_id, \
+                    "config {} = {}".format(k, v), push, ("config", k)):
+                    push()
+
+    def set_config_param(self, node_id, param, value):
+        """
+            set one configuration parameter of a node.
+
+            Args:
+                node_id: the id of node
+                param: the parameter number
+                value: the value of parameter
+            Return: None
+        """
+        with mesh_slot(PRIORITY_CONFIG, node_id):
+            self.network.nodes[node_id].set_config_param(param, value)
+
+    def config_all_nodes(self):
+        """
+            set all nodes using parameter and value specified in zwave.json.
+            And update node name according to zwave.json file.
+
+            Args: None
+            Return: None
+        """
+        for node_id in self.network.nodes:
+            self.config_node(node_id)
+            self.update_node_name(node_id)
+
+    def update_node_name(self, node_id):
+        """
+            update the nodes' name according to zwave.json config file
+
+            Args: node_id the id of node (a positive integer)
+            Return: None
+        """
+        if node_id in self.mapping:
+            with mesh_slot(PRIORITY_CONFIG, node_id):
+                self.network.nodes[node_id].name = self.mapping[node_id]
+            if identities is not None:
+                identities.invalidate(node_id)
+
+    @staticmethod
+    def check_node_connection(network, node_id):
+        """ 
+            This function aims to check whether the node (specified by 
+            node_id) is connected in network. If not, the value, which is old 
+            historical data, will be abandoned.
+
+            Args: node id of specified nodes in network
+            Return: ture if node is still connected in the network, or 
+            otherwise 
+
+            Note: the health table (node_health) is consulted, which is kept 
+            by node notifications and the prober, and the manager is only 
+            asked if there is no health table.
+        """
+        if node_health is not None:
+            return node_health.usable(node_id)
+        if network.manager.isNodeFailed(network.home_id, node_id):
+            return False
+        return True
+
+class MeshScheduler:
+    """
+        Class of MeshScheduler: the scheduler which all operations on the 
+        controller go through, one at a time.
+
+        Waiting operations are granted in the order of priority class 
+        (actuate > alarm > read > config), and within a class in round robin 
+        of nodes, so that a node with many operations can not hold up other 
+        nodes. Each operation costs a number of transmissions from a token 
+        bucket refilled at tx_per_second, bulk operations wait once it runs 
+        out. Switch commands never wait for the bucket, they only wait for 
+        the operation being executed, and the transmissions they take are 
+        paid back by the operations after them.
+
+        The operation is executed by the calling thread while it holds the 
+        slot, a thread already holding the slot is not scheduled again.
+    """
+    def __init__(self, tx_per_second=TX_PER_SECOND, burst=TX_BURST):
+        """
+            Args:
+                tx_per_second: transmissions allowed per second
+                burst: max transmissions saved up in the bucket
+            Return: None
+        """
+        self.rate = float(tx_per_second)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.refilled = time.time()
+        self.cond = threading.Condition()
+        self.queues = [collections.OrderedDict() for p in PRIORITY_NAMES]
+        self.busy = False
+        self.holder = threading.local()
+        self.seq = 0
+        # counters
+        self.granted = [0] * len(PRIORITY_NAMES)
+        self.waited = [0.0] * len(PRIORITY_NAMES)
+
+    def refill(self, now):
+        """
+            refill the token bucket, must be called with lock held.
+        """
+        if self.rate > 0:
+            self.tokens = min(self.burst, \
+                self.tokens + (now - self.refilled) * self.rate)
+        else:
+            self.tokens = self.burst
+        self.refilled = now
+
+    def head(self):
+        """
+            Return: (priority, node id) of the next operation to grant, or 
+            None, must be called with lock held
+        """
+        for priority, queue in enumerate(self.queues):
+            for node_id in queue:
+                return priority, node_id
+        return None
+
+    @contextlib.contextmanager
+    def slot(self, priority, node_id, cost=1):
+        """
+            wait for the turn of an operation, and hold the slot while it is 
+            executed by the with block.
+
+            Args:
+                priority: one of PRIORITY_* classes
+                node_id: the node the operation goes to
+                cost: transmissions taken by the operation, 0 for operations 
+                    only served by the controller (e.g. reading cached value)
+            Return: context manager
+        """
+        if getattr(self.holder, "held", False):
+            yield                          # nested operation
+            return
+        start = time.time()
+        with self.cond:
+            self.seq += 1
+            ticket = self.seq
+            self.queues[priority].setdefault(node_id, \
+                collections.deque()).append(ticket)
+            while True:
+                wait = None
+                if not self.busy and self.head() == (priority, node_id) \
+                    and self.queues[priority][node_id][0] == ticket:
+                    now = time.time()
+                    self.refill(now)
+                    if priority == PRIORITY_ACTUATE or cost <= 0 or \
+                        self.tokens >= min(cost, self.burst):
+                        break
+                    wait = (min(cost, self.burst) - self.tokens) / self.rate
+                self.cond.wait(wait)
+            # take the operation out, the node goes to the end of its class
+            queue = self.queues[priority]
+            tickets = queue.pop(node_id)
+            tickets.popleft()
+            if tickets:
+                queue[node_id] = tickets
+            self.tokens -= cost
+            self.busy = True
+            self.granted[priority] += 1
+            self.waited[priority] += time.time() - start
+        self.holder.held = True
+        try:
+            yield
+        finally:
+            self.holder.held = False
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    def load(self):
+        """
+            Return: (operations granted, seconds waited in total) of all 
+            classes but actuate, which tell how busy the mesh is
+        """
+        with self.cond:
+            return sum(self.granted[PRIORITY_ALARM:]), \
+                sum(self.waited[PRIORITY_ALARM:])
+
+    def report(self):
+        """
+            Return: status string of granted operations and their average 
+            waiting time of each priority class
+        """
+        with self.cond:
+            return "scheduler: " + ", ".join("{} = {} ({:.3f}s avg wait)" \
+                .format(name, self.granted[p], \
+                self.waited[p] / self.granted[p] if self.granted[p] else 0) \
+                for p, name in enumerate(PRIORITY_NAMES)) + \
+                ", backlog = {}\n".format(sum(len(t) for q in self.queues \
+                for t in q.values()))
+
+@contextlib.contextmanager
+def mesh_slot(priority, node_id, cost=1):
+    """
+        hold the slot of scheduler for an operation on the controller, the 
+        operation is executed at once if there is no scheduler.
+
+        Args:
+            priority: one of PRIORITY_* classes
+            node_id: the node the operation goes to
+            cost: transmissions taken by the operation
+        Return: context manager
+    """
+    if scheduler is None:
+        yield
+        return
+    with scheduler.slot(priority, node_id, cost):
+        yield
+
+class NodeHealth:
+    """
+        Class of NodeHealth: the health table of nodes (alive, dead, awake or 
+        asleep) and the time and cause of the last change of each node.
+
+        The table is seeded once the network is ready, then kept by node 
+        notifications (Dead, Alive, Awake, Sleep) instead of asking the 
+        manager for each read. A background prober refreshes the table from 
+        the manager every probe_interval seconds, and sends a no operation 
+        frame to dead nodes, which come back alive once they answer.
+    """
+    ALIVE = "alive"
+    DEAD = "dead"
+    AWAKE = "awake"
+    ASLEEP = "asleep"
+    # node notification codes -> state
+    NOTIFICATIONS = {"Dead": DEAD, "Alive": ALIVE, "Awake": AWAKE, \
+        "Sleep": ASLEEP}
+
+    def __init__(self, probe_interval=PROBE_INTERVAL):
+        """
+            Args: probe_interval seconds between probes, 0 to disable prober
+            Return: None
+        """
+        self.probe_interval = float(probe_interval)
+        self.lock = threading.Lock()
+        self.nodes = {}          # node id -> (state, since, cause)
+        self.network = None
+        self.stopping = threading.Event()
+        self.prober = None
+        # counters
+        self.notified = 0
+        self.probes = 0
+
+    def set(self, node_id, state, cause):
+        """
+            record the state of a node, the time is kept if it is unchanged.
+        """
+        with self.lock:
+            old = self.nodes.get(node_id)
+            if old is None or old[0] != state:
+                self.nodes[node_id] = (state, time.time(), cause)
+
+    def query(self, network, node_id):
+        """
+            ask the manager for the state of a node.
+
+            Return: one of the states
+        """
+        manager = network.manager
+        if manager.isNodeFailed(network.home_id, node_id):
+            return NodeHealth.DEAD
+        if not manager.isNodeAwake(network.home_id, node_id):
+            return NodeHealth.ASLEEP
+        return NodeHealth.ALIVE
+
+    def seed(self, network):
+        """
+            build the table of all nodes in network.
+
+            Args: network the openzwave network instance
+            Return: None
+        """
+        self.network = network
+        for node_id in network.nodes:
+            self.set(node_id, self.query(network, node_id), "startup")
+
+    def notify(self, node_id, code):
+        """
+            update the table from a node notification.
+
+            Args:
+                node_id: the id of node
+                code: notification code, e.g. "Dead"
+            Return: None
+        """
+        state = NodeHealth.NOTIFICATIONS.get(str(code))
+        if state is None:
+            return
+        with self.lock:
+            self.notified += 1
+        self.set(node_id, state, "notification " + str(code))
+
+    def forget(self, node_id):
+        """
+            drop a removed node.
+        """
+        with self.lock:
+            self.nodes.pop(node_id, None)
+
+    def state(self, node_id):
+        """
+            Return: the state of node, ALIVE if it is unknown
+        """
+        return self.nodes.get(node_id, (NodeHealth.ALIVE, ))[0]
+
+    def usable(self, node_id):
+        """
+            Return: True if the values of node can be read, i.e. the node is 
+            not dead (the last values of a sleeping node are still valid)
+        """
+        return self.state(node_id) != NodeHealth.DEAD
+
+    def describe(self, node_id):
+        """
+            Return: string of the state of node and since when it is so
+        """
+        state, since, cause = self.nodes.get(node_id, \
+            (NodeHealth.ALIVE, None, "unknown"))
+        if since is None:
+            return state
+        return "{} for {:.0f} s ({})".format(state, time.time() - since, cause)
+
+    def start(self):
+        """
+            start the background prober.
+        """
+        if self.probe_interval <= 0 or self.prober is not None:
+            return
+        self.prober = threading.Thread(target=self.probe_loop, name="health")
+        self.prober.daemon = True
+        self.prober.start()
+
+    def probe_loop(self):
+        """
+            prober routine: refresh the table from the manager and test dead 
+            nodes every probe_interval seconds.
+        """
+        while not self.stopping.wait(self.probe_interval):
+            network = self.network
+            if network is None:
+                continue
+            for node_id in list(network.nodes):
+                try:
+                    # the state is cached by the manager, only the test 
+                    # of a dead node is transmitted
+                    state = self.query(network, node_id)
+                    self.set(node_id, state, "probe")
+                    if state == NodeHealth.DEAD:
+                        # the node is marked alive by notification if it 
+                        # answers
+                        with mesh_slot(PRIORITY_READ, node_id):
+                            network.manager.testNetworkNode( \
+                                network.home_id, node_id, 1)
+                    with self.lock:
+                        self.probes += 1
+                except Exception as e:
+                    print("Error in probing node {}: {}".format(node_id, e))
+
+    def stop(self):
+        """
+            stop the background prober.
+        """
+        self.stopping.set()
+        if self.prober is not None:
+            self.prober.join()
+
+    def report(self):
+        """
+            Return: status string of the health of each node
+        """
+        report = "Node health:\n"
+        for node_id in sorted(self.nodes):
+            report += "    node {}: {}\n".format(node_id, \
+                self.describe(node_id))
+        with self.lock:
+            report += "    notifications = {}, probes = {}\n".format( \
+                self.notified, self.probes)
+        return report
+
+class PendingOperation:
+    """
+        Class of PendingOperation: an operation waiting for a sleeping node 
+        to wake up, and its status.
+    """
+    def __init__(self, node_id, name, run):
+        self.node_id = node_id
+        self.name = name
+        self.run = run
+        self.queued = time.time()
+        self.finished = None
+        self.status = "queued"
+
+    def finish(self, status):
+        """
+            record the outcome of the operation.
+        """
+        self.finished = time.time()
+        self.status = status
+
+    def describe(self):
+        """
+            Return: status string of the operation
+        """
+        if self.finished is None:
+            return "node {} {} : queued for {:.0f} s\n".format(self.node_id, \
+                self.name, time.time() - self.queued)
+        return "node {} {} : {} (queued {:.0f} s)\n".format(self.node_id, \
+            self.name, self.status, self.finished - self.queued)
+
+class WakeQueue:
+    """
+        Class of WakeQueue: the operations (configuration pushes, refreshes 
+        and switch commands) to sleeping battery nodes, which are queued per 
+        node and executed in one burst once the node wakes up, instead of 
+        stalling the thread which issued them.
+
+        Whether a node is asleep is told by the health table (node_health). 
+        An operation with a key replaces the queued operation of the same 
+        key, e.g. a newer value of the same configuration parameter. The 
+        status of pending and the last finished operations is kept for -i.
+    """
+    def __init__(self, history=WAKE_HISTORY):
+        """
+            Args: history number of finished operations kept
+            Return: None
+        """
+        self.lock = threading.Lock()
+        self.pending = {}        # node id -> OrderedDict key -> operation
+        self.finished = collections.deque(maxlen=history)
+        self.seq = 0
+        # counters
+        self.wakeups = 0
+        self.executed = 0
+
+    @staticmethod
+    def asleep(node_id):
+        """
+            Return: True if the node is known to be asleep
+        """
+        return node_health is not None and \
+            node_health.state(node_id) == NodeHealth.ASLEEP
+
+    def defer(self, node_id, name, run, key=None):
+        """
+            queue an operation if the node is asleep.
+
+            Args:
+                node_id: the id of node
+                name: name of operation shown in status
+                run: routine executing the operation, it may return a 
+                    status string
+                key: operations of the same key replace each other, None 
+                    to always queue the operation
+            Return: True if the operation is queued, False if the node is 
+                awake and the caller need execute it at once
+        """
+        with self.lock:
+            # checked with lock held, so the operation can not miss the 
+            # wake up of node
+            if not WakeQueue.asleep(node_id):
+                return False
+            if key is None:
+                self.seq += 1
+                key = self.seq
+            queue = self.pending.setdefault(node_id, collections.OrderedDict())
+            old = queue.pop(key, None)
+            if old is not None:
+                old.finish("superseded")
+                self.finished.append(old)
+            queue[key] = PendingOperation(node_id, name, run)
+        return True
+
+    def wake(self, node_id):
+        """
+            execute the operations of a node which woke up, in a thread of 
+            its own.
+
+            Args: node_id the id of node
+            Return: None
+        """
+        with self.lock:
+            queue = self.pending.pop(node_id, None)
+            if not queue:
+                return
+            self.wakeups += 1
+        flusher = threading.Thread(target=self.flush, \
+            args=(queue.values(), ), name="wake-{}".format(node_id))
+        flusher.daemon = True
+        flusher.start()
+
+    def flush(self, operations):
+        """
+            execute operations one after another and record their status.
+
+            Args: operations list of PendingOperation
+            Return: None
+        """
+        for operation in operations:
+            try:
+                status = operation.run()
+                operation.finish(status.strip() if status else "done")
+            except Exception as e:
+                operation.finish("failed: {}".format(e))
+            with self.lock:
+                self.executed += 1
+                self.finished.append(operation)
+
+    def drop(self, node_id):
+        """
+            drop the operations of a removed node.
+        """
+        with self.lock:
+            for operation in self.pending.pop(node_id, {}).values():
+                operation.finish("dropped, node removed")
+                self.finished.append(operation)
+
+    def report(self):
+        """
+            Return: status string of pending and finished operations
+        """
+        with self.lock:
+            report = "Operations of sleeping nodes:\n"
+            for node_id in sorted(self.pending):
+                for operation in self.pending[node_id].values():
+                    report += "    " + operation.describe()
+            for operation in self.finished:
+                report += "    " + operation.describe()
+            report += "    wake ups = {}, executed = {}\n".format( \
+                self.wakeups, self.executed)
+        return report
+
+class PolledValue:
+    """
+        Class of PolledValue: the polling state of one value.
+    """
+    def __init__(self, node_id, intensity, data):
+        self.node_id = node_id
+        self.base = intensity    # intensity configured in zwave.json
+        self.adapted = intensity # intensity adapted to the change rate
+        self.applied = 0         # intensity enabled on the controller
+        self.changes = 0         # changes of value since last adjustment
+        self.last = data
+
+class PollSchedule:
+    """
+        Class of PollSchedule: the polling of values configured by the poll 
+        item of zwave.json, which is applied through the value polling of 
+        openzwave once the network is ready.
+
+        openzwave polls all polled values once per cycle of interval 
+        seconds, and a value of intensity n once every n cycles. Each value 
+        is configured by node id and label ("*" being the wildcard, the most 
+        specific rule applies as for the rules item) with either:
+            interval: the seconds between two polls of the value, rounded 
+                to cycles;
+            intensity: the number of cycles between two polls.
+        Every adjust_interval seconds the intensity is adapted to the value:
+        a value which did not change since last adjustment is polled half 
+        as often, and a value which changed at least every other poll goes 
+        back towards its configured rate. Besides, all values are polled 
+        half as often while the operations of the scheduler wait longer 
+        than load_wait seconds on average. A value is never polled less 
+        than max_backoff times its configured rate.
+
+        Polling is enabled on the controller by the adjuster thread only: 
+        the signal handlers (value added) hand the value over and return at 
+        once, instead of waiting for a slot of the scheduler.
+    """
+    def __init__(self, poll):
+        """
+            Args: poll the poll item of zwave.json
+            Return: None
+        """
+        self.interval = float(poll.get("interval", POLL_INTERVAL))
+        self.adjust_interval = float(poll.get("adjust_interval", \
+            POLL_ADJUST))
+        self.max_backoff = max(1, int(poll.get("max_backoff", \
+            POLL_MAX_BACKOFF)))
+        self.load_wait = float(poll.get("load_wait", POLL_LOAD_WAIT))
+        self.rules = {}          # (node id or "*", label or "*") -> intensity
+        for node_k, labels in poll.get("values", {}).items():
+            node_k = LISTEN_ANY if str(node_k) == LISTEN_ANY else int(node_k)
+            for label, rule in labels.items():
+                self.rules[(node_k, str(label))] = self.parse(rule)
+        self.lock = threading.Condition()
+        self.values = {}         # value id -> PolledValue
+        self.pending = {}        # value id -> (node id, intensity) to apply
+        self.network = None
+        self.load = 1            # slow down factor for the load of mesh
+        self.seen = (0, 0.0)     # load of scheduler at last adjustment
+        self.stopping = threading.Event()
+        self.adjuster = None
+        # counters
+        self.slowed = 0
+        self.sped = 0
+
+    def parse(self, rule):
+        """
+            parse one rule of zwave.json.
+
+            Return: the intensity, i.e. cycles between two polls
+        """
+        if "intensity" in rule:
+            return max(1, int(rule["intensity"]))
+        return max(1, int(round(float(rule.get("interval", self.interval)) \
+            / self.interval)))
+
+    def rule(self, node_id, label):
+        """
+            find the most specific rule of a value.
+
+            Return: the intensity, or None if the value is not polled
+        """
+        for k in ((node_id, label), (node_id, LISTEN_ANY), \
+                  (LISTEN_ANY, label), (LISTEN_ANY, LISTEN_ANY)):
+            if k in self.rules:
+                return self.rules[k]
+        return None
+
+    def apply(self, network):
+        """
+            set the poll cycle and enable polling of all configured values 
+            in network.
+
+            Args: network the openzwave network instance
+            Return: None
+        """
+        self.network = network
+        if not self.rules:
+            return
+        network.set_poll_interval(int(self.interval * 1000), False)
+        for node_id in network.nodes:
+            node = network.nodes[node_id]
+            for value_id in node.values:
+                self.add_value(node_id, node.values[value_id])
+
+    def add_value(self, node_id, value):
+        """
+            enable polling of a value if it is configured.
+
+            Args:
+                node_id: the id of node
+                value: the instance of value
+            Return: None
+        """
+        intensity = self.rule(node_id, value.label)
+        if intensity is None or self.network is None:
+            return
+        with self.lock:
+            polled = PolledValue(node_id, intensity, value.data)
+            self.values[value.value_id] = polled
+            polled.applied = min(intensity * self.max_backoff, \
+                intensity * self.load)
+            self.pending[value.value_id] = (node_id, polled.applied)
+            self.lock.notify()
+
+    def enable(self, node_id, value_id, intensity):
+        """
+            enable polling of a value on the controller with the intensity.
+        """
+        try:
+            with mesh_slot(PRIORITY_CONFIG, node_id, 0):
+                self.network.manager.enablePoll(value_id, intensity)
+        except Exception as e:
+            print("Error in polling value {}: {}".format(value_id, e))
+
+    def observe(self, value_id, data):
+        """
+            count a change of a polled value.
+
+            Args:
+                value_id: the id of value
+                data: the new data of value
+            Return: None
+        """
+        polled = self.values.get(value_id)
+        if polled is None:
+            return
+        with self.lock:
+            if data != polled.last:
+                polled.changes += 1
+                polled.last = data
+
+    def forget(self, value_id):
+        """
+            drop a removed value.
+        """
+        with self.lock:
+            self.values.pop(value_id, None)
+            self.pending.pop(value_id, None)
+
+    def forget_node(self, node_id):
+        """
+            drop all values of a removed node.
+        """
+        with self.lock:
+            for value_id in [value_id for value_id, polled in \
+                self.values.items() if polled.node_id == node_id]:
+                del self.values[value_id]
+                self.pending.pop(value_id, None)
+
+    def mesh_load(self):
+        """
+            Return: avg seconds waited by operations of the scheduler since 
+            last adjustment
+        """
+        if scheduler is None:
+            return 0.0
+        granted, waited = scheduler.load()
+        seen, self.seen = self.seen, (granted, waited)
+        if granted <= seen[0]:
+            return 0.0
+        return (waited - seen[1]) / (granted - seen[0])
+
+    def adjust(self):
+        """
+            adapt the intensity of all polled values to their change rate 
+            and to the load of mesh, the ones which changed are left to be 
+            applied.
+        """
+        load = self.mesh_load()
+        with self.lock:
+            if load > self.load_wait:
+                self.load = min(self.max_backoff, self.load * 2)
+            elif load < self.load_wait / 2:
+                self.load = max(1, self.load // 2)
+            for value_id, polled in self.values.items():
+                polls = self.adjust_interval / \
+                    (self.interval * polled.applied) if polled.applied else 0
+                limit = polled.base * self.max_backoff
+                if polled.changes == 0:
+                    polled.adapted = min(limit, polled.adapted * 2)
+                elif polled.changes * 2 >= polls:
+                    polled.adapted = max(polled.base, polled.adapted // 2)
+                polled.changes = 0
+                intensity = min(limit, polled.adapted * self.load)
+                if intensity != polled.applied:
+                    if intensity > polled.applied:
+                        self.slowed += 1
+                    else:
+                        self.sped += 1
+                    polled.applied = intensity
+                    self.pending[value_id] = (polled.node_id, intensity)
+
+    def start(self):
+        """
+            start the background adjustment of polling.
+        """
+        if not self.rules or self.adjuster is not None:
+            return
+        self.adjuster = threading.Thread(target=self.adjust_loop, \
+            name="poll")
+        self.adjuster.daemon = True
+        self.adjuster.start()
+
+    def adjust_loop(self):
+        """
+            adjuster routine: enable polling of the values handed over, 
+            and adjust polling every adjust_interval seconds.
+        """
+        due = time.time() + self.adjust_interval
+        while not self.stopping.is_set():
+            try:
+                if self.adjust_interval > 0 and time.time() >= due:
+                    due = time.time() + self.adjust_interval
+                    self.adjust()
+                with self.lock:
+                    if not self.pending and not self.stopping.is_set():
+                        self.lock.wait(max(0.0, due - time.time()) \
+                            if self.adjust_interval > 0 else None)
+                    pending, self.pending = self.pending, {}
+                for value_id, (node_id, intensity) in pending.items():
+                    self.enable(node_id, value_id, intensity)
+            except Exception as e:
+                print("Error in adjusting polling: {}".format(e))
+
+    def stop(self):
+        """
+            stop the background adjustment of polling.
+        """
+        self.stopping.set()
+        with self.lock:
+            self.lock.notify_all()
+        if self.adjuster is not None:
+            self.adjuster.join()
+
+    def report(self):
+        """
+            Return: status string of polled values and adjustments
+        """
+        with self.lock:
+            polls = sum(1.0 / polled.applied for polled in \
+                self.values.values() if polled.applied)
+            return "poll: values = {}, cycle = {}s, polls per cycle = " \
+                "{:.2f}, load factor = {}, slowed = {}, sped up = {}\n" \
+                .format(len(self.values), self.interval, polls, self.load, \
+                self.slowed, self.sped)
+
+class ListenFilter:
+    """
+        Class of ListenFilter: the listen item of zwave.json compiled into 
+        hashed sets, which decides whether a value is listened.
+
+        The listen item maps node id to a list of labels, and "*" can be 
+        used as wildcard for both:
+            "2": ["Temperature"]    Temperature of node 2
+            "3": ["*"]              all values of node 3
+            "*": ["Battery Level"]  Battery Level of all nodes
+            "*": ["*"]              all values of all nodes
+        The decision of each value is cached by value id once the value is 
+        seen (or resolved when network is ready), hence a value update is 
+        accepted or rejected with one dict lookup.
+    """
+    def __init__(self, rules):
+        """
+            Args: rules the listen item of zwave.json
+            Return: None
+        """
+        self.pairs = set()       # (node id, label)
+        self.nodes = set()       # node id whose values are all listened
+        self.labels = set()      # label listened on all nodes
+        self.everything = False  # all values of all nodes are listened
+        self.values = {}         # value id -> True/False
+        for k, v in rules.items():
+            labels = [str(label) for label in v]
+            if str(k) == LISTEN_ANY:
+                if LISTEN_ANY in labels:
+                    self.everything = True
+                self.labels.update(labels)
+            elif LISTEN_ANY in labels:
+                self.nodes.add(int(k))
+            else:
+                self.pairs.update((int(k), label) for label in labels)
+
+    def match(self, node_id, label):
+        """
+            check the rules for a value.
+
+            Args:
+                node_id: the id of node
+                label: the label of value
+            Return: True if the value is listened
+        """
+        return self.everything or \
+            (node_id, label) in self.pairs or \
+            node_id in self.nodes or \
+            label in self.labels
+
+    def accept(self, node_id, value):
+        """
+            check whether a value is listened, the decision is cached by 
+            value id.
+
+            Args:
+                node_id: the id of node
+                value: the instance of value
+            Return: True if the value is listened
+        """
+        listened = self.values.get(value.value_id)
+        if listened is None:
+            listened = self.match(node_id, value.label)
+            self.values[value.value_id] = listened
+        return listened
+
+    def resolve(self, network):
+        """
+            resolve the rules to value ids of all values in network.
+
+            Args: network the openzwave network instance
+            Return: None
+        """
+        values = {}
+        for node_id in network.nodes:
+            node = network.nodes[node_id]
+            for value_id in node.values:
+                values[value_id] = \
+                    self.match(node_id, node.values[value_id].label)
+        self.values = values
+
+    def forget(self, value_id):
+        """
+            drop the cached decision of a removed value.
+        """
+        self.values.pop(value_id, None)
+
+class PublishRules:
+    """
+        Class of PublishRules: the rules deciding whether a new value of a 
+        sensor point is worth publishing, configured by the rules item of 
+        zwave.json. Each rule may define:
+            deadband: the min change of value to be published, either 
+                absolute (e.g. "0.5") or percentage of last published value 
+                (e.g. "2%"). Unchanged values are never published;
+            min_interval: min seconds between two published values;
+            heartbeat: max seconds between two published values, the value 
+                is published once this passes even if it is not changed.
+        The rules are keyed by node id and label, "*" being the wildcard. 
+        The most specific rule applies, i.e. (node, label), (node, *), 
+        (*, label) and then (*, *). Sensor points without rule are always 
+        published.
+    """
+    def __init__(self, rules):
+        """
+            Args: rules the rules item of zwave.json
+            Return: None
+        """
+        self.rules = {}          # (node id or "*", label or "*") -> rule
+        for node_k, labels in rules.items():
+            node_k = LISTEN_ANY if str(node_k) == LISTEN_ANY else int(node_k)
+            for label, rule in labels.items():
+                self.rules[(node_k, str(label))] = PublishRules.parse(rule)
+        self.lock = threading.Lock()
+        self.resolved = {}       # (node id, label) -> rule or None
+        self.last = {}           # value id -> (published value, time)
+
+    @staticmethod
+    def parse(rule):
+        """
+            parse one rule of zwave.json.
+
+            Return: (deadband, True if deadband is percentage, min interval, 
+                heartbeat)
+        """
+        deadband = str(rule.get("deadband", "0")).strip()
+        percent = deadband.endswith("%")
+        if percent:
+            deadband = deadband[:-1]
+        return (abs(float(deadband)), percent, \
+            float(rule.get("min_interval", 0)), \
+            float(rule.get("heartbeat", 0)))
+
+    def rule(self, node_id, label):
+        """
+            find the most specific rule of a sensor point.
+
+            Return: the rule, or None if no rule applies
+        """
+        key = (node_id, label)
+        if key not in self.resolved:
+            found = None
+            for k in (key, (node_id, LISTEN_ANY), (LISTEN_ANY, label), \
+                      (LISTEN_ANY, LISTEN_ANY)):
+                if k in self.rules:
+                    found = self.rules[k]
+                    break
+            self.resolved[key] = found
+        return self.resolved[key]
+
+    @staticmethod
+    def changed(rule, last, current):
+        """
+            check whether the change of value passes the deadband.
+        """
+        if isinstance(current, numbers.Number) and \
+           isinstance(last, numbers.Number) and \
+           not isinstance(current, bool) and not isinstance(last, bool):
+            deadband, percent = rule[0], rule[1]
+            if percent:
+                deadband = abs(last) * deadband / 100.0
+            if deadband > 0:
+                return abs(current - last) >= deadband
+        return current != last
+
+    def accept(self, node_id, value, current, now=None):
+        """
+            decide whether a new value of a sensor point is published, and 
+            record it as the last published value if it is.
+
+            Args:
+                node_id: the id of node
+                value: the instance of value
+                current: the new value
+                now: the time of the value, now if it is None
+            Return: True if the value need be published
+        """
+        rule = self.rule(node_id, value.label)
+        if rule is None:
+            return True
+        if now is None:
+            now = time.time()
+        min_interval, heartbeat = rule[2], rule[3]
+        with self.lock:
+            last = self.last.get(value.value_id)
+            if last is not None:
+                elapsed = now - last[1]
+                if not (heartbeat > 0 and elapsed >= heartbeat):
+                    if elapsed < min_interval or \
+                       not PublishRules.changed(rule, last[0], current):
+                        return False
+            self.last[value.value_id] = (current, now)
+            return True
+
+    def forget(self, value_id):
+        """
+            drop the last published value of a removed value.
+        """
+        with self.lock:
+            self.last.pop(value_id, None)
+
+class ValueIndex:
+    """
+        Class of ValueIndex: the index from value id to the kinds of the 
+        value (sensor, thermostat, battery level etc.) of each node.
+
+        The index is built once the network is ready, and updated on value 
+        added/removed and node added/removed signals. Hence finding the kind 
+        of a value costs one dict lookup, instead of querying the manager 
+        with all node.get_*() routines.
+    """
+    def __init__(self):
+        """
+            Create an empty index
+        """
+        self.lock = threading.Lock()
+        self.nodes = {}          # node id -> {value id -> tuple of kinds}
+
+    @staticmethod
+    def scan_node(node):
+        """
+            query the kinds of all values of a node.
+
+            Args: node the instance of node
+            Return: dict value id -> tuple of kinds
+        """
+        members = [(kind, getattr(node, getter)()) \
+            for kind, getter in VALUE_KINDS]
+        index = {}
+        for value_id in node.values:
+            index[value_id] = tuple(kind for kind, values in members \
+                if value_id in values)
+        return index
+
+    def build(self, network):
+        """
+            build the index of all nodes in network.
+
+            Args: network the openzwave network instance
+            Return: None
+        """
+        nodes = {}
+        for node_id in network.nodes:
+            nodes[node_id] = ValueIndex.scan_node(network.nodes[node_id])
+        with self.lock:
+            self.nodes = nodes
+
+    def add_node(self, node):
+        """
+            (re)index all values of a node.
+        """
+        index = ValueIndex.scan_node(node)
+        with self.lock:
+            self.nodes[node.node_id] = index
+
+    def remove_node(self, node_id):
+        """
+            drop a node from the index.
+        """
+        with self.lock:
+            self.nodes.pop(node_id, None)
+
+    def add_value(self, node, value_id):
+        """
+            index one value of a node.
+        """
+        kinds = tuple(kind for kind, getter in VALUE_KINDS \
+            if value_id in getattr(node, getter)())
+        with self.lock:
+            self.nodes.setdefault(node.node_id, {})[value_id] = kinds
+
+    def remove_value(self, node_id, value_id):
+        """
+            drop a value from the index.
+        """
+        with self.lock:
+            if node_id in self.nodes:
+                self.nodes[node_id].pop(value_id, None)
+
+    def kinds(self, node, value_id):
+        """
+            get the kinds of a value, the node is indexed if it is unknown.
+
+            Args:
+                node: the instance of node
+                value_id: the id of value
+            Return: tuple of kinds, empty tuple if the value is of no kind
+        """
+        index = self.nodes.get(node.node_id)
+        if index is None or value_id not in index:
+            self.add_node(node)
+            index = self.nodes[node.node_id]
+        return index.get(value_id, ())
+
+    def has(self, node, value_id, kind):
+        """
+            Return: True if the value is of the kind
+        """
+        return kind in self.kinds(node, value_id)
+
+class SwitchIndex:
+    """
+        Class of SwitchIndex: the index from label of switch to its value id 
+        of each node, shared by all ZwaveActuator.
+
+        Like ValueIndex, the index is built once the network is ready and 
+        updated on value added/removed and node added/removed signals, hence 
+        finding a switch costs one dict lookup, instead of querying the 
+        manager with node.get_switches() for each command.
+    """
+    def __init__(self):
+        """
+            Create an empty index
+        """
+        self.lock = threading.Lock()
+        self.nodes = {}          # node id -> {label -> value id}
+        self.switches = set()    # value ids of all indexed switches
+
+    @staticmethod
+    def scan_node(node):
+        """
+            query all switches of a node.
+
+            Args: node the instance of node
+            Return: dict label -> value id, the first switch of a label wins
+        """
+        index = {}
+        for value_id in sorted(node.get_switches()):
+            index.setdefault(node.values[value_id].label, value_id)
+        return index
+
+    def build(self, network):
+        """
+            build the index of all nodes in network.
+
+            Args: network the openzwave network instance
+            Return: None
+        """
+        nodes = {}
+        for node_id in network.nodes:
+            nodes[node_id] = SwitchIndex.scan_node(network.nodes[node_id])
+        with self.lock:
+            self.nodes = nodes
+            self.switches = set(value_id for index in nodes.values() \
+                for value_id in index.values())
+
+    def add_node(self, node):
+        """
+            (re)index all switches of a node.
+        """
+        index = SwitchIndex.scan_node(node)
+        with self.lock:
+            self.switches.difference_update( \
+                self.nodes.get(node.node_id, {}).values())
+            self.nodes[node.node_id] = index
+            self.switches.update(index.values())
+
+    def remove_node(self, node_id):
+        """
+            drop a node from the index.
+        """
+        with self.lock:
+            self.switches.difference_update( \
+                self.nodes.pop(node_id, {}).values())
+
+    def add_value(self, node, value):
+        """
+            index one value of a node if it is a switch.
+        """
+        if value.value_id not in node.get_switches():
+            return
+        with self.lock:
+            index = self.nodes.setdefault(node.node_id, {})
+            if value.label not in index:
+                index[value.label] = value.value_id
+                self.switches.add(value.value_id)
+
+    def remove_value(self, node_id, value_id):
+        """
+            drop a value from the index.
+        """
+        with self.lock:
+            index = self.nodes.get(node_id, {})
+            for label in [l for l in index if index[l] == value_id]:
+                del index[label]
+            self.switches.discard(value_id)
+
+    def is_switch(self, value_id):
+        """
+            Return: True if the value is an indexed switch
+        """
+        return value_id in self.switches
+
+    def find(self, node, label):
+        """
+            find the switch of a label, the node is indexed if it is unknown.
+
+            Args:
+                node: the instance of node
+                label: the label of the switch
+            Return: the value id of switch, or -1 if there is no such switch
+        """
+        index = self.nodes.get(node.node_id)
+        if index is None:
+            self.add_node(node)
+            index = self.nodes[node.node_id]
+        return index.get(label, -1)
+
+class SwitchStates:
+    """
+        Class of SwitchStates: the last state of each switch confirmed by the 
+        switch itself (SIGNAL_VALUE), and the state of the last command sent 
+        to it which is not confirmed yet.
+
+        Hence toggle flips the known state without reading the switch first, 
+        and two toggles in a row flip the switch twice, as the second toggle 
+        flips the state sent by the first one. Commands of one switch are 
+        serialized by a lock of the switch. A state sent which the switch 
+        does not confirm within expire seconds (e.g. a scene activated on a 
+        switch which never reports back) is dropped.
+    """
+    def __init__(self, expire=VERIFY_TIMEOUT):
+        """
+            Args: expire seconds a state sent waits for its confirmation
+            Return: None
+        """
+        self.expire = float(expire)
+        self.cond = threading.Condition()
+        self.confirmed = {}      # value id -> last confirmed state
+        self.pending = {}        # value id -> (state sent, expiry time)
+        self.reports = {}        # value id -> number of states reported
+        self.locks = {}          # value id -> lock of commands
+
+    def lock(self, value_id):
+        """
+            Return: the lock serializing commands to the switch
+        """
+        with self.cond:
+            if value_id not in self.locks:
+                self.locks[value_id] = threading.Lock()
+            return self.locks[value_id]
+
+    def sent(self, value_id):
+        """
+            the state sent to a switch which is not confirmed yet, must be 
+            called with lock held. An expired state is dropped.
+
+            Return: the state, or None
+        """
+        pending = self.pending.get(value_id)
+        if pending is None:
+            return None
+        if pending[1] <= time.time():
+            del self.pending[value_id]
+            return None
+        return pending[0]
+
+    def confirm(self, value_id, state):
+        """
+            record the state reported by a switch.
+        """
+        state = bool(state)
+        with self.cond:
+            self.confirmed[value_id] = state
+            self.reports[value_id] = self.reports.get(value_id, 0) + 1
+            if self.sent(value_id) == state:
+                del self.pending[value_id]
+            self.cond.notify_all()
+
+    def current(self, value_id, read):
+        """
+            the state the switch is (or is going to be) in.
+
+            Args:
+                value_id: the id of switch
+                read: routine reading the state if it is not known yet
+            Return: the state sent last, or the confirmed state
+        """
+        with self.cond:
+            sent = self.sent(value_id)
+            if sent is not None:
+                return sent
+            if value_id in self.confirmed:
+                return self.confirmed[value_id]
+        state = bool(read())
+        with self.cond:
+            self.confirmed.setdefault(value_id, state)
+            return self.confirmed[value_id]
+
+    def expect(self, value_id, state):
+        """
+            record the state sent to a switch.
+
+            Return: number of states reported so far, which is passed to 
+                wait()
+        """
+        with self.cond:
+            self.pending[value_id] = (bool(state), time.time() + self.expire)
+            return self.reports.get(value_id, 0)
+
+    def wait(self, value_id, state, timeout, reports):
+        """
+            wait for the switch to confirm a state after it is sent.
+
+            Args:
+                value_id: the id of switch
+                state: the expected state
+                timeout: max seconds to wait
+                reports: number of states reported when the state is sent
+            Return: True if confirmed, otherwise the state sent is dropped
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.reports.get(value_id, 0) <= reports or \
+                self.confirmed.get(value_id) != state:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if self.sent(value_id) == state:
+                        del self.pending[value_id]
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def drop_pending(self):
+        """
+            drop the states sent to all switches, e.g. after switch all, 
+            which leaves the state of each switch to be confirmed.
+        """
+        with self.cond:
+            self.pending.clear()
+
+    def settled(self, value_id, state):
+        """
+            Return: True if the switch has confirmed the state and no other 
+            state has been sent since
+        """
+        with self.cond:
+            return self.sent(value_id) is None and \
+                self.confirmed.get(value_id) == bool(state)
+
+    def forget(self, value_id):
+        """
+            drop the state of a removed switch.
+        """
+        with self.cond:
+            self.confirmed.pop(value_id, None)
+            self.pending.pop(value_id, None)
+            self.reports.pop(value_id, None)
 
-class ZwaveNetwork:
+class SwitchBurst:
     """
-        Class of zwavenetwork:
-        In the context of the instance of ZwaveNetwork the instance of zwave 
-        sensor and zwave actuator is able to proceeded.
+        Class of SwitchBurst: the commands to one switch merged into one, 
+        and the outcome shared by all callers.
     """
-    def __init__(self):
+    def __init__(self, state):
         """
-            Initialize using zwave.json config file defined in CONFIG variable
+            Args: state True (on), False (off) or None (toggle)
+            Return: None
         """
-        global MAX_THREAD
-        global listen
-        multisensor_cred = Setting(CONFIG)
-        self.device = str(multisensor_cred.setting["device"])
-        self.log = str(multisensor_cred.setting["log"])
-        self.log_file = str(multisensor_cred.setting["log_file"])
-        self.write_file = bool(multisensor_cred.setting["write_log_file"])
-        self.output_console = bool(multisensor_cred.setting["write_console"])
-        # format config dict
-        self.config = {}
-        for config_k, config_v in multisensor_cred.setting["config"].items():
-            item = {}
-            for k, v in config_v.iteritems():
-                item[int(k)] = int(v)   
-            self.config[int(config_k)] = item
-
-        for k, v in multisensor_cred.setting["listen"].items():
-            item = []
-            for node in v:
-                item.append(str(node))
-            listen[int(k)] = item
+        self.state = None        # state to set, None if only toggled
+        self.flips = 0           # number of toggles after state
+        self.callers = 0
+        self.result = None
+        self.done = threading.Event()
+        self.merge(state)
+
+    def merge(self, state):
+        """
+            merge the next command: on/off overrides all commands before it, 
+            a toggle flips the result of commands before it.
+        """
+        self.callers += 1
+        if state is None:
+            self.flips += 1
+        else:
+            self.state = bool(state)
+            self.flips = 0
 
-        self.mapping  = {int(k): str(v) \
-            for k, v in multisensor_cred.setting["mapping"].iteritems()}
-        MAX_THREAD = int(multisensor_cred.setting["MAX_THREAD"])
+    def final(self):
+        """
+            Return: (state to set, True if anything need be sent). The state 
+            is None for a toggle, and nothing is sent if toggles cancel out.
+        """
+        if self.state is None:
+            return None, self.flips % 2 == 1
+        return self.state != (self.flips % 2 == 1), True
 
-    def network_init(self):
+class SwitchCommands:
+    """
+        Class of SwitchCommands: coalescing of the commands to each switch.
+
+        A command to an idle switch is sent at once. Commands arriving while 
+        the switch is busy, or within window seconds after the last command 
+        was sent, are merged into one burst, which is sent once the switch 
+        is free and the window has passed. Every caller of a burst gets the 
+        outcome of the burst, hence a burst of on/off/toggle only takes one 
+        transmission on the mesh (or none if the switch is already in the 
+        final state), and commands are applied in the order they arrive.
+    """
+    def __init__(self, window=COALESCE_WINDOW):
         """
-            Zwave network initialization.
-            Terminate program if initialization failed.
+            Args: window seconds after a command during which the following 
+                commands are merged
+            Return: None
         """
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger('openzwave')
+        self.window = float(window)
+        self.cond = threading.Condition()
+        self.busy = set()        # value ids of switches being sent to
+        self.last = {}           # value id -> time the last command was sent
+        self.bursts = {}         # value id -> SwitchBurst waiting
+        # counters
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    def submit(self, value_id, state, send):
+        """
+            send a command to a switch, or merge it into the waiting burst.
 
-        # option initialization, abort if initialization failed
+            Args:
+                value_id: the id of switch
+                state: True (on), False (off) or None (toggle)
+                send: routine sending a state (None to toggle) to the switch, 
+                    returning the status string
+            Return: status string of the command (or of its burst)
+        """
+        with self.cond:
+            now = time.time()
+            if value_id not in self.busy and value_id not in self.bursts \
+                and now - self.last.get(value_id, 0.0) >= self.window:
+                self.busy.add(value_id)
+                self.last[value_id] = now
+                self.sent += 1
+                burst = None
+            elif value_id in self.bursts:
+                self.bursts[value_id].merge(state)
+                self.coalesced += 1
+                burst = self.bursts[value_id]
+                while not burst.done.is_set():
+                    self.cond.wait()
+                return burst.result
+            else:
+                burst = SwitchBurst(state)
+                self.bursts[value_id] = burst
+        if burst is None:
+            return self.run(value_id, send, state)
+        # the first caller of burst sends it once the switch is free
+        with self.cond:
+            while True:
+                wait = self.last.get(value_id, 0.0) + self.window - time.time()
+                if value_id not in self.busy and wait <= 0:
+                    break
+                self.cond.wait(wait if wait > 0 else None)
+            del self.bursts[value_id]
+            state, needed = burst.final()
+            if needed and state is not None and \
+                switch_states.settled(value_id, state):
+                needed = False               # already in final state
+            if needed:
+                self.busy.add(value_id)
+                self.last[value_id] = time.time()
+                self.sent += 1
+            else:
+                self.skipped += 1
+        if needed:
+            burst.result = self.run(value_id, send, state)
+        else:
+            burst.result = "on/off : success\n"
+        with self.cond:
+            burst.done.set()
+            self.cond.notify_all()
+        return burst.result
+
+    def run(self, value_id, send, state):
+        """
+            send a state to the switch and mark the switch free afterwards.
+        """
         try:
-            options = ZWaveOption(self.device, \
-             config_path="../openzwave/config", \
-             user_path=".", cmd_line="")
-            options.set_log_file(self.log_file)
-            options.set_append_log_file(self.write_file)
-            options.set_console_output(self.output_console)
-            options.set_save_log_level(self.log)
-            options.set_logging(False)
-            options.lock()
+            return send(state)
         except Exception as e:
-            print("Zwave initialization failed!")
-            print("Please check the USB port of Zwave Stick")
-            print(e)
-            sys.exit(-1)
+            return "Error in sending command: {}\n".format(e)
+        finally:
+            with self.cond:
+                self.busy.discard(value_id)
+                self.cond.notify_all()
 
-        # create a network instance
-        self.network = ZWaveNetwork(options, log=None)
+    def report(self):
+        """
+            Return: status string of the counters
+        """
+        with self.cond:
+            return "switch commands: sent = {}, coalesced = {}, skipped = {}" \
+                "\n".format(self.sent, self.coalesced, self.skipped)
 
-    def network_awake(self):
+class ValueSnapshot:
+    """
+        Class of ValueSnapshot: the latest value and update time of each 
+        listened sensor point.
+
+        The snapshot is seeded when the network is ready, and updated by 
+        the SIGNAL_VALUE handler, hence a read request is answered from the 
+        snapshot without querying the manager for each value. A point is 
+        flagged as stale once it has not been updated for stale_after 
+        seconds.
+    """
+    def __init__(self, stale_after=STALE_AFTER):
         """
-            Awake zwave network.
-            Terminated program if awake failed! 
+            Args: stale_after seconds after which a value is stale
+            Return: None
         """
-        print("INFO: Waiting for network awaked :")
+        self.stale_after = float(stale_after)
+        self.lock = threading.Lock()
+        self.points = {}    # (node id, value id) -> (data, update time)
 
-        for i in range(0, 300):
-            if self.network.state >= self.network.STATE_AWAKED:
-                break
-            else:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                time.sleep(1.0)
+    def seed(self, network):
+        """
+            record current value of all listened values in network.
 
-        if self.network.state < self.network.STATE_AWAKED:
-            sys.exit("Network is not awake, program abort!")
+            Args: network the openzwave network instance
+            Return: None
+        """
+        now = time.time()
+        points = {}
+        for node_id in network.nodes:
+            node = network.nodes[node_id]
+            for value_id in node.values:
+                value = node.values[value_id]
+                if listen.accept(node_id, value):
+                    points[(node_id, value_id)] = (value.data, now)
+        with self.lock:
+            points.update(self.points)   # keep values updated meanwhile
+            self.points = points
+
+    def update(self, node_id, value_id, data, when=None):
+        """
+            record the latest value of a point.
 
-        for i in range(0, 300):
-            if self.network.state >= self.network.STATE_READY:
-                break
-            else:
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                time.sleep(1.0)
+            Args:
+                node_id: the id of node
+                value_id: the id of value
+                data: the latest value
+                when: the update time, now if it is None
+            Return: None
+        """
+        if when is None:
+            when = time.time()
+        with self.lock:
+            self.points[(node_id, value_id)] = (data, when)
 
-        if not self.network.is_ready:
-            sys.exit("Network is not ready, program abort!")
-        print("\nINFO: Network [{}] awaked!" .format(self.network.home_id_str))
-        print("INFO: Number of nodes: [{}]" .format(self.network.nodes_count))
+    def forget(self, node_id, value_id):
+        """
+            drop the point of a removed value.
+        """
+        with self.lock:
+            self.points.pop((node_id, value_id), None)
 
-    def config_node(self, node_id):
+    def get(self, node_id, value_id):
         """
-            config a node specified by node id.
+            Return: (data, update time) of a point, or None if never seen
+        """
+        return self.points.get((node_id, value_id))
 
-            Args: node id of specific node
+    def age(self, node_id, value_id):
+        """
+            Return: seconds since the last update of a point, or None if the 
+            point has never been seen
+        """
+        point = self.points.get((node_id, value_id))
+        if point is None:
+            return None
+        return time.time() - point[1]
+
+    def is_stale(self, node_id, value_id):
+        """
+            Return: True if the point is not updated for stale_after seconds
+        """
+        age = self.age(node_id, value_id)
+        return age is not None and age > self.stale_after
+
+class IdentityCache:
+    """
+        Class of IdentityCache: the pre-built identity (mac id and source 
+        name) of each sensor point, shared by all payload builders.
+
+        The identity only changes when a node is renamed or re-interviewed, 
+        hence the identities of a node are dropped on node naming and node 
+        protocol info signals, as well as when the node is renamed by the 
+        engine, and rebuilt at next use.
+    """
+    def __init__(self):
+        """
+            Create an empty cache
+        """
+        self.lock = threading.Lock()
+        self.nodes = {}     # node id -> {value id -> (mac id, source name)}
+
+    def get(self, network, node, value):
+        """
+            get the identity of a sensor point.
+
+            Args:
+                network: the openzwave network instance
+                node: the instance of node
+                value: the instance of value
+            Return: (mac id, source name)
+        """
+        points = self.nodes.get(node.node_id)
+        if points is not None and value.value_id in points:
+            return points[value.value_id]
+        ident = (ZwaveSensor.get_mac_id(node, value), \
+            ZwaveSensor.get_source_name(network, node, value))
+        with self.lock:
+            self.nodes.setdefault(node.node_id, {})[value.value_id] = ident
+        return ident
+
+    def invalidate(self, node_id, value_id=None):
+        """
+            drop the identities of a node, or of one value of the node.
+
+            Args:
+                node_id: the id of node
+                value_id: the id of value, None for all values of the node
             Return: None
         """
-        if node_id in self.config:
-            for k, v in self.config[node_id].iteritems():
-                self.network.nodes[node_id].set_config_param(k, v)
+        with self.lock:
+            if value_id is None:
+                self.nodes.pop(node_id, None)
+            elif node_id in self.nodes:
+                self.nodes[node_id].pop(value_id, None)
 
-    def config_all_nodes(self):
+class Subscriber:
+    """
+        Class of Subscriber: a client which receives value updates pushed by 
+        the engine ('-S' command).
+
+        The updates matching the filter of subscriber are kept in a bounded 
+        buffer until they are sent to the client. Once the buffer is full, 
+        the client is too slow to keep up and is disconnected, instead of the 
+        engine buffering without bound.
+    """
+    def __init__(self, node_id, label, kind, size, wake=None):
         """
-            set all nodes using parameter and value specified in zwave.json.
-            And update node name according to zwave.json file.
+            Args:
+                node_id: node id to subscribe, LISTEN_ANY for all nodes
+                label: label of value to subscribe, LISTEN_ANY for all labels
+                kind: kind of value to subscribe, LISTEN_ANY for all kinds
+                size: max number of buffered updates
+                wake: routine called when there are updates to send, or None
+            Return: None
+        """
+        self.node_id = node_id
+        self.label = label
+        self.kind = kind
+        self.size = max(1, int(size))
+        self.wake = wake
+        self.cond = threading.Condition()
+        self.buffer = collections.deque()
+        self.closed = None       # reason of disconnect
+        # counters
+        self.delivered = 0
 
-            Args: None
+    @staticmethod
+    def parse(args, size, wake=None):
+        """
+            create a subscriber from arguments of '-S' command.
+
+            Args:
+                args: [node_id [label [kind]]], "*" for any
+                size: max number of buffered updates
+                wake: routine called when there are updates to send
+            Return: the instance of Subscriber
+        """
+        args = list(args) + [LISTEN_ANY] * (3 - len(args))
+        node_id = args[0] if args[0] == LISTEN_ANY else int(args[0])
+        kinds = [kind for kind, getter in VALUE_KINDS] + [KIND_ALARM]
+        if args[2] != LISTEN_ANY and args[2] not in kinds:
+            raise ValueError("Unknown kind: " + args[2])
+        return Subscriber(node_id, args[1], args[2], size, wake)
+
+    def describe(self):
+        """
+            Return: string of the filter of subscriber
+        """
+        return "node = {}, label = {}, kind = {}".format(self.node_id, \
+            self.label, self.kind)
+
+    def matches(self, node_id, label, kinds):
+        """
+            Return: True if the update of the value is subscribed
+        """
+        return (self.node_id == LISTEN_ANY or self.node_id == node_id) and \
+            (self.label == LISTEN_ANY or self.label == label) and \
+            (self.kind == LISTEN_ANY or self.kind in kinds)
+
+    def push(self, update):
+        """
+            buffer an update, disconnect the subscriber if buffer is full.
+
+            Args: update the string of update
             Return: None
         """
-        for node_id in self.network.nodes:
-            self.config_node(node_id)
-            self.update_node_name(node_id)
+        with self.cond:
+            if self.closed is not None:
+                return
+            if len(self.buffer) >= self.size:
+                self.closed = "Disconnected: slow consumer, {} updates " \
+                    "buffered\n".format(len(self.buffer))
+                self.buffer.clear()
+            else:
+                self.buffer.append(update)
+            self.cond.notify_all()
+        if self.wake is not None:
+            self.wake()
 
-    def update_node_name(self, node_id):
+    def close(self, reason):
         """
-            update the nodes' name according to zwave.json config file
+            disconnect the subscriber.
+        """
+        with self.cond:
+            if self.closed is None:
+                self.closed = reason
+            self.cond.notify_all()
+        if self.wake is not None:
+            self.wake()
+
+    def take(self, timeout=0):
+        """
+            take buffered updates.
 
-            Args: node_id the id of node (a positive integer)
+            Args: timeout max seconds to wait for an update
+            Return: (string of updates, reason if disconnected or None)
+        """
+        with self.cond:
+            if not self.buffer and self.closed is None and timeout:
+                self.cond.wait(timeout)
+            updates = "".join(self.buffer)
+            self.delivered += len(self.buffer)
+            self.buffer.clear()
+            return updates, self.closed
+
+class Subscriptions:
+    """
+        Class of Subscriptions: all subscribers of value updates. Every value 
+        update received by the engine is pushed to the subscribers whose 
+        filter matches, as one json line:
+            {"node_id": ., "label": ., "kinds": [.], "value": ., "time": .}
+    """
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS):
+        """
+            Args: max_subscribers max number of subscribers
             Return: None
         """
-        if node_id in self.mapping:
-            self.network.nodes[node_id].name = self.mapping[node_id]
+        self.max_subscribers = int(max_subscribers)
+        self.lock = threading.Lock()
+        self.subscribers = []
+        # counters
+        self.published = 0
+        self.disconnected = 0
+
+    def add(self, subscriber):
+        """
+            Return: True if the subscriber is added, False if there are too 
+            many subscribers
+        """
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return False
+            self.subscribers = self.subscribers + [subscriber]
+            return True
 
-    def network_stop(self):
+    def remove(self, subscriber):
         """
-            Stop network.
+            forget a subscriber whose client has gone away.
         """
-        self.network.stop()
-        print("INFO: Network stopped")
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers = [s for s in self.subscribers \
+                    if s is not subscriber]
+                if subscriber.closed is not None:
+                    self.disconnected += 1
+
+    def publish(self, node_id, value, data, kinds):
+        """
+            push a value update to matching subscribers.
 
-    @staticmethod
-    def check_node_connection(network, node_id):
-        """ 
-            This function aims to check whether the node (specified by 
-            node_id) is connected in network. If not, the value, which is old 
-            historical data, will be abandoned.
+            Args:
+                node_id: the id of node
+                value: the instance of value
+                data: the data of value
+                kinds: kinds of value
+            Return: None
+        """
+        subscribers = self.subscribers     # replaced, never changed in place
+        if not subscribers:
+            return
+        update = None
+        for subscriber in subscribers:
+            if not subscriber.matches(node_id, value.label, kinds):
+                continue
+            if update is None:
+                update = json.dumps({"node_id": node_id, \
+                    "label": value.label, "kinds": list(kinds), \
+                    "value": data, "time": time.time()}, default=str) + "\n"
+            subscriber.push(update)
+        if update is not None:
+            with self.lock:
+                self.published += 1
+
+    def close_all(self, reason):
+        """
+            disconnect all subscribers.
+        """
+        for subscriber in self.subscribers:
+            subscriber.close(reason)
 
-            Args: node id of specified nodes in network
-            Return: ture if node is still connected in the network, or 
-            otherwise 
+    def report(self):
+        """
+            Return: status string of subscriptions
+        """
+        with self.lock:
+            return "subscriptions: subscribers = {}, published = {}, " \
+                "disconnected = {}\n".format(len(self.subscribers), \
+                self.published, self.disconnected)
 
-            Note: this function is used for debugging purpose
+class NodeScan:
+    """
+        Class of NodeScan: the reading of one node during a scan of all 
+        nodes, which is run by a worker of scan pool. It takes the place of 
+        BatchPublisher in sens_one_node, and keeps the sensor points read from 
+        the node until the scan hands them to the publisher.
+    """
+    def __init__(self, sensor, node_id):
         """
-        if network.manager.isNodeFailed(network.home_id, node_id):
-            return False
+            Args:
+                sensor: the instance of ZwaveSensor
+                node_id: the id of node to read
+            Return: None
+        """
+        self.sensor = sensor
+        self.node_id = node_id
+        self.points = []         # (sensor point, tag) or (None, note)
+        self.error = None
+        self.started = None
+        self.done = threading.Event()
+
+    def add(self, sdata, tag=""):
+        """
+            keep one sensor point read from the node.
+        """
+        self.points.append((sdata, tag))
+
+    def note(self, name, status):
+        """
+            keep a status line of the node, e.g. the node is skipped.
+        """
+        self.points.append((None, (name, status)))
+
+    def run(self):
+        """
+            read all sensor points of the node.
+        """
+        self.started = time.time()
+        try:
+            self.sensor.sens_one_node(self.node_id, self)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.done.set()
+
+    def wait(self, timeout, deadline):
+        """
+            wait for the node being read.
+
+            Args:
+                timeout: max seconds since the reading is started
+                deadline: time after which a reading not started is given up
+            Return: True if the node is read, False if timed out
+        """
+        while not self.done.is_set():
+            limit = deadline
+            if self.started is not None:
+                limit = min(limit, self.started + timeout)
+            now = time.time()
+            if now >= limit:
+                return False
+            self.done.wait(min(limit - now, 1.0))
         return True
 
 class ZwaveSensor:
@@ -232,16 +2326,120 @@ class ZwaveSensor:
         The zwave sensor is only able to proceeded in the contextual of a 
         valid ZwaveNetwork
     """
-    def __init__(self, network):
+    # reader routine of each value kind
+    READERS = {KIND_SENSOR: "read_sensor_value", \
+        KIND_THERMOSTAT: "read_thermostats_value", \
+        KIND_BATTERY: "read_battery_value", \
+        KIND_DIMMER: "read_dimmer_value", \
+        KIND_RGBBULB: "read_rgbbulbs_value", \
+        KIND_POWER_LEVEL: "read_power_level"}
+
+    def __init__(self, network, max_age=None, emit=None):
         """
             the zwave sensor is able to be launched in contextual of instance 
             of ZwaveNetwork
 
-            Args: network the instance of ZwaveNetwork
+            Args: 
+                network: the instance of ZwaveNetwork
+                max_age: only publish the sensor points updated within 
+                    max_age seconds, None to publish all sensor points
+                emit: routine streaming each status line to the client, None 
+                    to return all status lines at the end
             Return: None
         """
         multisensor_cred = Setting(CONFIG)
         self.network = network.network   # nethwork instance
+        self.max_batch = network.max_batch
+        self.flush_interval = network.flush_interval
+        self.node_timeout = network.node_timeout
+        self.max_age = max_age
+        self.emit = emit
+        self.publishers = []     # publishers created by this instance
+
+    def fresh(self, node_id, value_id):
+        """
+            check whether a sensor point is updated within max_age seconds.
+
+            Args:
+                node_id: the id of node
+                value_id: the id of value
+            Return: True if the point need be published
+        """
+        if self.max_age is None:
+            return True
+        age = snapshot.age(node_id, value_id)
+        return age is not None and age <= self.max_age
+
+    def current(self, node_id, value_id, getter):
+        """
+            get the latest value of a sensor point from the snapshot. The 
+            manager is only queried if the point has not been seen.
+
+            Args:
+                node_id: the id of node
+                value_id: the id of value
+                getter: the node routine reading the value from manager
+            Return: the latest value
+        """
+        point = snapshot.get(node_id, value_id)
+        if point is None:
+            data = getter(value_id)
+            snapshot.update(node_id, value_id, data)
+            return data
+        return point[0]
+
+    def tag(self, node_id, value_id):
+        """
+            Return: " [stale]" if the value of sensor point is stale, or ""
+        """
+        if snapshot.is_stale(node_id, value_id):
+            return " [stale]"
+        return ""
+
+    def new_publisher(self):
+        """
+            create a publisher gathering the sensor points of one scan
+
+            Args: None
+            Return: instance of BatchPublisher
+        """
+        publisher = BatchPublisher(self.max_batch, self.flush_interval, \
+            spool.post, self.emit, batched=True)
+        self.publishers.append(publisher)
+        return publisher
+
+    def join(self):
+        """
+            post the pending points of all publishers of this instance, and 
+            wait for their batches in flight (posted by the flush timer), so 
+            that no status is emitted once the command returns.
+
+            Args: None
+            Return: None
+        """
+        for publisher in self.publishers:
+            publisher.flush()
+
+    def publish(self, sdata, publisher=None, tag=""):
+        """
+            hand a sensor point over to the publisher of current scan. If 
+            there is no publisher, the point is posted at once.
+
+            Args:
+                sdata: sensor point dict {mac_id, <source name>: <value>}
+                publisher: BatchPublisher of current scan or None
+                tag: note appended to the source name in status string
+            Return:
+                status string if the point is posted at once, or "" if the 
+                point is pending in the publisher
+        """
+        print(sdata)
+        if publisher is None:
+            publisher = self.new_publisher()
+            publisher.add(sdata, tag)
+            return publisher.report()
+        publisher.add(sdata, tag)
+        return ""
 
     @staticmethod
     def get_mac_id(node, value):
@@ -271,7 +2469,7 @@ class ZwaveSensor:
             src.append(value.units)
         return '_'.join(src)
 
-    def read_power_level(self, node_id, value_id):
+    def read_power_level(self, node_id, value_id, publisher=None):
         """
             Read one power level value from a specified node, after which the 
             data will be posted to BuildingDepot using RESTful api.
@@ -283,30 +2481,31 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
              ZwaveNetwork.check_node_connection(self.network, node_id) and\
-             value_id in node.get_power_levels():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)         
+             value_index.has(node, value_id, KIND_POWER_LEVEL):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_power_level(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_power_level)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""                   
 
-    def read_rgbbulbs_value(self, node_id, value_id):
+    def read_rgbbulbs_value(self, node_id, value_id, publisher=None):
         """
             Read one rgb bulbs level value from a specified node, after which the data will be posted to BuildingDepot using RESTful api.
 
@@ -317,30 +2516,31 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
              ZwaveNetwork.check_node_connection(self.network, node_id) and\
-             value_id in node.get_rgbbulbs():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)          
+             value_index.has(node, value_id, KIND_RGBBULB):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_dimmer_level(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_dimmer_level)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""           
 
-    def read_dimmer_value(self, node_id, value_id):
+    def read_dimmer_value(self, node_id, value_id, publisher=None):
         """
             Read one dimmer level value from a specified node, after which the 
             data will be posted to BuildingDepot using RESTful api.
@@ -352,30 +2552,31 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
              ZwaveNetwork.check_node_connection(self.network, node_id) and\
-             value_id in node.get_dimmers():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)          
+             value_index.has(node, value_id, KIND_DIMMER):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_dimmer_level(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_dimmer_level)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""       
 
-    def read_battery_value(self, node_id, value_id):
+    def read_battery_value(self, node_id, value_id, publisher=None):
         """
             Read one battery level value from a specified node, after which the data will be posted to BuildingDepot using RESTful api.
 
@@ -386,30 +2587,31 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
              ZwaveNetwork.check_node_connection(self.network, node_id) and\
-             value_id in node.get_battery_levels():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)          
+             value_index.has(node, value_id, KIND_BATTERY):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_battery_level(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_battery_level)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""
 
-    def read_thermostats_value(self, node_id, value_id):
+    def read_thermostats_value(self, node_id, value_id, publisher=None):
         """
             Read one thermostats value from a specified node, after which the 
             data will be posted to BuildingDepot using RESTful api.
@@ -421,30 +2623,31 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
              ZwaveNetwork.check_node_connection(self.network, node_id) and\
-             value_id in node.get_thermostats():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node)          
+             value_index.has(node, value_id, KIND_THERMOSTAT):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_thermostat_value(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_thermostat_value)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""
 
-    def read_sensor_value(self, node_id, value_id):
+    def read_sensor_value(self, node_id, value_id, publisher=None):
         """
             Read one sensor value from a specified node, after which the data 
             will be posted to BuildingDepot using RESTful api.
@@ -456,84 +2659,141 @@ class ZwaveSensor:
             Args:
                 node_id: the id of sepcified node
                 value_id: the id of value (sensor point) on the specified node
+                publisher: BatchPublisher gathering sensor points of a scan,
+                    the point is posted at once if it is None
             Return:
                 status string indicates the sensing and posting process
         """
-        global listen
         node = self.network.nodes[node_id]
         value = node.values[value_id]
-        if node_id in listen and \
-             value.label in listen[node_id] and\
-             ZwaveNetwork.check_node_connection(self.network, node_id) and \
-             value_id in node.get_sensors():
-            sdata = {}
-            sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)     
+        if listen.accept(node_id, value) and \
+             self.fresh(node_id, value_id) and \
+             ZwaveNetwork.check_node_connection(self.network, node_id) and\
+             value_index.has(node, value_id, KIND_SENSOR):
             # get sensor data
-            sdata[ZwaveSensor.get_source_name(self.network, node, value)] = \
-                node.get_sensor_value(value_id)
-            # assemble data
-            data = {"sensor_data":{}}
-            data["sensor_data"].update(sdata)
+            data = self.current(node_id, value_id, node.get_sensor_value)
+            if not rules.accept(node_id, value, data):
+                return ""             # suppressed by publishing rules
+            sdata = {}
+            mac_id, src = identities.get(self.network, node, value)
+            sdata["mac_id"] = mac_id
+            sdata[src] = data
             # post data
-            print(data)
-            return str(get_json(json.dumps(data)))   # return a string
+            return self.publish(sdata, publisher, \
+                self.tag(node_id, value_id))
         return ""
 
     def snes_all_nodes(self):
         """
-            Read all sensor points from all nodes.
+            Read all sensor points from all nodes.
+
+            Note: A specific sensor points may be skipped once the value is 
+            not specified in zwave.json (listen item) or the node is not 
+            connected property. All sensor points of the scan are posted in 
+            batches.
+
+            The nodes are read concurrently by the scan pool, and the sensor 
+            points of each node are handed to the publisher in the order of 
+            node id as soon as the node and all nodes before it are read. A 
+            node not read within node_timeout seconds (since it is started) is 
+            reported as timed out, and does not hold up the other nodes.
+
+            Args: None
+            Return: status string, one line per sensor point, in the order of 
+                node id
+        """
+        publisher = self.new_publisher()
+        scans = [NodeScan(self, node_id) \
+            for node_id in sorted(self.network.nodes)]
+        for scan in scans:
+            scan_pool.submit(scan)
+        # a node which never starts is waited for at most as long as a 
+        # sequential scan of all nodes would take
+        deadline = time.time() + self.node_timeout * len(scans)
+        for scan in scans:
+            if not scan.wait(self.node_timeout, deadline):
+                publisher.note("Node {}".format(scan.node_id), \
+                    "Timeout after {}s, skipped".format(self.node_timeout))
+                continue
+            ZwaveSensor.hand_over(scan, publisher)
+            if scan.error is not None:
+                publisher.note("Node {}".format(scan.node_id), \
+                    "Error in reading node: " + scan.error)
+        return publisher.report()
+
+    def sens_one_node(self, node_id, publisher=None):
+        """
+            Read all sensor points from a specified node.
 
             Note: A specific sensor points may be skipped once the value is 
             not specified in zwave.json (listen item) or the node is not 
             connected property.
 
-            Args: None
+            Args: 
+                node_id: the specified node
+                publisher: BatchPublisher of current scan, a new one is 
+                    created and flushed if it is None
+            Return: status string, one line per sensor point, or "" if the 
+                points are left in the passed in publisher
+        """
+        own = publisher is None
+        if own:
+            # points are posted after the node is read
+            points = NodeScan(self, node_id)
+        else:
+            points = publisher
+        if not node_health.usable(node_id):
+            points.note("Node {}".format(node_id), "skipped, node is " + \
+                node_health.describe(node_id))
+            return self.sens_done(own, points)
+        node = self.network.nodes[node_id]
+        if self.max_age is not None and wake_queue.defer(node_id, \
+            "refresh", functools.partial(self.refresh, node_id), "refresh"):
+            points.note("Node {}".format(node_id), \
+                "asleep, refresh queued until wake up")
+        for val_id in node.values:
+            for kind in value_index.kinds(node, val_id):
+                if kind in ZwaveSensor.READERS:
+                    # cached values are read, nothing is transmitted, 
+                    # hence no slot of scheduler is taken
+                    getattr(self, ZwaveSensor.READERS[kind])(node_id, \
+                        val_id, points)
+        return self.sens_done(own, points)
+
+    def refresh(self, node_id):
+        """
+            request all values of a node, the new values arrive as value 
+            updates.
+
+            Args: node_id the id of node
             Return: None
         """
-        msg = ""
-        for node_id in self.network.nodes:
-            tmp = self.sens_one_node(node_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-        return msg
+        with mesh_slot(PRIORITY_READ, node_id):
+            self.network.nodes[node_id].request_state()
 
-    def sens_one_node(self, node_id):
+    def sens_done(self, own, points):
         """
-            Read all sensor points from a specified node.
+            post the points read by sens_one_node with its own publisher.
 
-            Note: A specific sensor points may be skipped once the value is 
-            not specified in zwave.json (listen item) or the node is not 
-            connected property.
+            Return: status string, or "" if the points are left in the 
+                publisher of caller
+        """
+        if own:
+            publisher = self.new_publisher()
+            ZwaveSensor.hand_over(points, publisher)
+            return publisher.report()
+        return ""
 
-            Args: node_id the specified node
-            Return: None
+    @staticmethod
+    def hand_over(scan, publisher):
         """
-        msg = ""
-        for val_id in self.network.nodes[node_id].values:
-            tmp = self.read_sensor_value(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-            tmp = ""
-            tmp = self.read_thermostats_value(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-            tmp = ""
-            tmp = self.read_battery_value(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-            tmp = ""
-            tmp = self.read_dimmer_value(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-            tmp = ""
-            tmp = self.read_rgbbulbs_value(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-            tmp = ""
-            tmp = self.read_power_level(node_id, val_id)
-            if not tmp.isspace():
-                msg = msg + tmp + "\n"
-        return msg
+            hand the points and notes kept by a NodeScan to publisher.
+        """
+        for sdata, tag in scan.points:
+            if sdata is None:
+                publisher.note(*tag)
+            else:
+                publisher.add(sdata, tag)
 
     @staticmethod
     def is_alarm(network, node_id, value_id):
@@ -541,15 +2801,9 @@ class ZwaveSensor:
            justify whether the updated value is alarm
         """
         node = network.nodes[node_id]
-        if value_id in node.get_sensors() or \
-          value_id in node.get_power_levels() or \
-          value_id in node.get_rgbbulbs() or \
-          value_id in node.get_dimmers() or \
-          value_id in node.get_battery_levels() or \
-          value_id in node.get_thermostats() or \
-          value_id in node.get_switches_all() or \
-          value_id in node.get_protections():
-            return False
+        for kind in value_index.kinds(node, value_id):
+            if kind in NON_ALARM_KINDS:
+                return False
         return True   
 
 class ZwaveActuator:
@@ -565,6 +2819,8 @@ class ZwaveActuator:
             Return: None
         """
         self.network = network.network
+        self.verify = network.verify
+        self.verify_timeout = network.verify_timeout
 
     def search_switch(self, node_id, label):
         """
@@ -576,27 +2832,80 @@ class ZwaveActuator:
                 label: the label of the switch
             Return: the id of the switch, or -1 if no switch can be found
         """
-        for val in self.network.nodes[node_id].get_switches():
-            if self.network.nodes[node_id].values[val].label == label:
-                return val
-        return -1
+        return switch_index.find(self.network.nodes[node_id], label)
 
-    def on(self, node_id, label):
+    def set_state(self, node_id, label, state=None):
         """
-            Turn on the switch.
+            Set the switch to a state.
+
+            Note: commands to the same switch within a short window are 
+            merged by switch_commands, and all callers get the outcome of 
+            the merged command. Commands to a sleeping node are queued until 
+            it wakes up.
 
             Args:
                 node_id: a node specified by node_id
                 label: the label of the switch
+                state: True to turn on, False to turn off, None to flip the 
+                    known state of switch
             Return: status string
                 {on/off : success} else
+                {on/off : not confirmed} else
+                {on/off : queued until node wakes up} else
                 {"Device Not Found/Error in fetching data"}             
         """
         val = self.search_switch(node_id, label)
-        if self.network.nodes[node_id].set_switch(val,True):
-            return "on/off : success\n"
-        else:
+        if val == -1:
             return "Device Not Found/Error in fetching data\n"
+        # a toggle is never replaced by a later command
+        command = "toggle" if state is None else ("on" if state else "off")
+        if wake_queue.defer(node_id, "{} {}".format(label, command), \
+            functools.partial(self.write, node_id, val, state), \
+            None if state is None else ("switch", val)):
+            return "on/off : queued until node wakes up\n"
+        return switch_commands.submit(val, state, \
+            lambda state: self.write(node_id, val, state))
+
+    def write(self, node_id, val, state):
+        """
+            Write a state to the switch.
+
+            Note: the value is written directly, as the switch is known from 
+            the index, node.set_switch() would query all switches of the node 
+            once more. If verify is set, the switch need confirm the new 
+            state within verify_timeout seconds.
+
+            Args:
+                node_id: a node specified by node_id
+                val: the value id of the switch
+                state: True to turn on, False to turn off, None to flip the 
+                    known state of switch
+            Return: status string
+        """
+        value = self.network.nodes[node_id].values[val]
+        with switch_states.lock(val):
+            if state is None:
+                state = not switch_states.current(val, lambda: value.data)
+            reports = switch_states.expect(val, state)
+            with mesh_slot(PRIORITY_ACTUATE, node_id):
+                value.data = state
+        if self.verify and not switch_states.wait(val, state, \
+            self.verify_timeout, reports):
+            return "on/off : not confirmed\n"
+        return "on/off : success\n"
+
+    def on(self, node_id, label):
+        """
+            Turn on the switch.
+
+            Args:
+                node_id: a node specified by node_id
+                label: the label of the switch
+            Return: status string
+                {on/off : success} else
+                {"Device Not Found/Error in fetching data"}             
+        """
+        return self.set_state(node_id, label, True)
 
     def off(self, node_id, label):
         """
@@ -609,16 +2918,15 @@ class ZwaveActuator:
                 {on/off : success} else
                 {"Device Not Found/Error in fetching data"}             
         """
-        val = self.search_switch(node_id, label)
-        if self.network.nodes[node_id].set_switch(val,False):
-            return "on/off : success\n"
-        else:
-            return "Device Not Found/Error in fetching data\n"
+        return self.set_state(node_id, label, False)
 
     def toggle(self, node_id, label):
         """
             Toggle the switch (change the switch state).
 
+            Note: the known state of switch is flipped, the switch is not 
+            read before it is written.
+
             Args:
                 node_id: a node specified by node_id
                 label: the label of the switch
@@ -626,10 +2934,7 @@ class ZwaveActuator:
                 {on/off : success} else
                 {"Device Not Found/Error in fetching data"}             
         """
-        if self.status(node_id, label):
-            return self.off(node_id,label)
-        else:
-            return self.on(node_id, label)
+        return self.set_state(node_id, label)
 
     def status(self, node_id, label):
         """
@@ -641,7 +2946,307 @@ class ZwaveActuator:
             Return: True/False (bool data)          
         """
         val = self.search_switch(node_id, label)
-        return self.network.nodes[node_id].get_switch_state(val) 
+        value = self.network.nodes[node_id].values[val]
+        return switch_states.current(val, lambda: value.data)
+
+    def multi(self, targets):
+        """
+            Send commands to many switches in one request.
+
+            Note: the commands to the same switch are merged first (e.g. on 
+            then toggle is off), then the commands to different switches are 
+            sent concurrently by the workers of actuate_pool, and the 
+            scheduler puts them on the mesh one after another without 
+            waiting for the round trip of each.
+
+            Args: targets list of (node_id, label, command)
+            Return: status string, one line "<node_id> <label> : <status>" 
+                for each switch in the order of request
+        """
+        bursts = collections.OrderedDict()  # (node id, label) -> burst
+        for node_id, label, command in targets:
+            if command not in SWITCH_COMMANDS:
+                raise ValueError("Switch Command Not Found: " + command)
+            key = (node_id, label)
+            if key in bursts:
+                bursts[key].merge(SWITCH_COMMANDS[command])
+            else:
+                bursts[key] = SwitchBurst(SWITCH_COMMANDS[command])
+        results = {}
+        done = threading.Condition()
+        def send(key, state):
+            try:
+                status = self.set_state(key[0], key[1], state)
+            except Exception as e:
+                status = "Error in setting switch: {}\n".format(e)
+            with done:
+                results[key] = status
+                done.notify_all()
+        sent = []
+        for key, burst in bursts.items():
+            state, needed = burst.final()
+            if key[0] <= 1 or key[0] not in self.network.nodes or \
+                self.search_switch(key[0], key[1]) == -1:
+                results[key] = "Device Not Found\n"
+            elif not needed:
+                results[key] = "on/off : success\n"
+            elif actuate_pool.submit(functools.partial(send, key, state)):
+                sent.append(key)
+            else:
+                results[key] = "Engine Stopped\n"
+        with done:
+            while any(key not in results for key in sent):
+                done.wait()
+        return "".join("{} {} : {}".format(key[0], key[1], results[key]) \
+            for key in bursts)
+
+    def switch_all(self, state):
+        """
+            Send switch all on/off, which is one broadcast frame to all nodes 
+            supporting switch all (and configured to respond to it).
+
+            Args: state True for on, False for off
+            Return: status string
+        """
+        with mesh_slot(PRIORITY_ACTUATE, NODE_BROADCAST):
+            self.network.switch_all(state)
+        switch_states.drop_pending()   # states are confirmed by the nodes
+        return "switch all {} : success\n".format("on" if state else "off")
+
+    def scene_value(self, node_id, label):
+        """
+            find the value of a node to put into scene, switches are found 
+            from the index, other values (e.g. dimmers) by label.
+
+            Return: the value id, or -1 if there is no such value
+        """
+        node = self.network.nodes[node_id]
+        val = switch_index.find(node, label)
+        if val != -1:
+            return val
+        for val in node.values:
+            if node.values[val].label == label:
+                return val
+        return -1
+
+    @staticmethod
+    def scene_data(text):
+        """
+            Return: the data of value in scene parsed from command argument, 
+            on/off for switches, or a number
+        """
+        if text in ("on", "off"):
+            return SWITCH_COMMANDS[text]
+        try:
+            return int(text)
+        except ValueError:
+            return float(text)
+
+    def find_scene(self, key):
+        """
+            Args: key the id or label of scene
+            Return: (scene id, instance of ZWaveScene), or (None, None)
+        """
+        scenes = self.network.get_scenes() or {}
+        for scene_id, scene in scenes.items():
+            if str(scene_id) == key or scene.label == key:
+                return scene_id, scene
+        return None, None
+
+    def list_scenes(self):
+        """
+            Return: status string, one line "<scene id> <label> : <number of 
+                values>" for each scene
+        """
+        scenes = self.network.get_scenes() or {}
+        return "".join("{} {} : {} values\n".format(scene_id, scene.label, \
+            len(scene.get_values())) for scene_id, scene in \
+            sorted(scenes.items())) or "No Scene\n"
+
+    def add_to_scene(self, key, targets):
+        """
+            Add values to a scene.
+
+            Args:
+                key: the id or label of scene
+                targets: list of (node_id, label, data)
+            Return: status string
+        """
+        scene_id, scene = self.find_scene(key)
+        if scene is None:
+            return "Scene Not Found\n"
+        msg = ""
+        for node_id, label, data in targets:
+            val = self.scene_value(node_id, label)
+            if val == -1:
+                msg = msg + "{} {} : Device Not Found\n".format(node_id, label)
+            elif scene.add_value(val, ZwaveActuator.scene_data(data)) or \
+                scene.set_value(val, ZwaveActuator.scene_data(data)):
+                msg = msg + "{} {} : added to scene {}\n".format(node_id, \
+                    label, scene_id)
+            else:
+                msg = msg + "{} {} : Error in adding value\n".format(node_id, \
+                    label)
+        return msg
+
+    def create_scene(self, label, targets):
+        """
+            Create a scene, and add values to it.
+
+            Args:
+                label: the label of scene
+                targets: list of (node_id, label, data)
+            Return: status string
+        """
+        if self.find_scene(label)[1] is not None:
+            return "Scene Exists\n"
+        scene_id = self.network.create_scene(label)
+        if not scene_id:
+            return "Error in creating scene\n"
+        return "scene {} {} : created\n".format(scene_id, label) + \
+            self.add_to_scene(str(scene_id), targets)
+
+    def activate_scene(self, key):
+        """
+            Activate a scene, which sets all of its values with one command 
+            to the controller.
+
+            Args: key the id or label of scene
+            Return: status string
+        """
+        scene_id, scene = self.find_scene(key)
+        if scene is None:
+            return "Scene Not Found\n"
+        with mesh_slot(PRIORITY_ACTUATE, NODE_BROADCAST):
+            done = scene.activate()
+        if not done:
+            return "scene {} : Error in activating scene\n".format(scene_id)
+        # switches of scene are going to the state of scene
+        for val, item in scene.get_values().items():
+            if switch_index.is_switch(val):
+                switch_states.expect(val, item["data"] \
+                    if isinstance(item, dict) else item)
+        return "scene {} : activated\n".format(scene_id)
+
+    def remove_scene(self, key):
+        """
+            Remove a scene.
+
+            Args: key the id or label of scene
+            Return: status string
+        """
+        scene_id, scene = self.find_scene(key)
+        if scene is None:
+            return "Scene Not Found\n"
+        self.network.remove_scene(scene_id)
+        return "scene {} : removed\n".format(scene_id)
+
+def parse_targets(args):
+    """
+        split arguments into (node_id, label, command or data) tuples.
+
+        Args: args list of arguments, three for each target
+        Return: list of tuples
+    """
+    if not args or len(args) % 3 != 0:
+        raise ValueError("Targets need be node_id label command")
+    return [(int(args[i]), args[i + 1], args[i + 2]) \
+        for i in range(0, len(args), 3)]
+
+def execute_command(network, cmds, emit=None):
+    """
+        Execute one command received from sens_zwave.py. This is shared by 
+        the thread per connection front end (task_thread) and the event 
+        driven front end (CommandServer).
+
+        Args:
+            network: the instance of ZwaveNetwork
+            cmds: list of command arguments, e.g. ["-r", "-1"]
+            emit: routine sending a part of response to the client at once, 
+                the status of each sensor point read by '-r' is streamed 
+                through it as soon as the point is posted
+        Return: (the rest of status string, True if the engine need be 
+            stopped)
+    """
+    global MAX_THREAD
+    exit = False
+    msg = ""
+    try:
+        if cmds[0] == "-r":
+            node_id = int(cmds[1])
+            max_age = float(cmds[2]) if len(cmds) > 2 else None
+            sensor = ZwaveSensor(network, max_age, emit)
+            try:
+                if node_id == -1:
+                    msg = msg + sensor.snes_all_nodes()
+                elif node_id > 1:
+                    msg = msg + sensor.sens_one_node(node_id)
+            finally:
+                # no status may be emitted after the end of response
+                sensor.join()
+        elif cmds[0] == "-w" and len(cmds) > 4:
+            actuator = ZwaveActuator(network)
+            msg = msg + actuator.multi(parse_targets(cmds[1:]))
+        elif cmds[0] == "-w":
+            node_id = int(cmds[1])
+            actuator = ZwaveActuator(network)
+            if node_id > 1 and \
+                actuator.search_switch(node_id, cmds[2]) != -1:
+                if cmds[3] == "on":
+                    msg = msg + actuator.on(node_id, cmds[2])
+                elif cmds[3] == "off":
+                    msg = msg + actuator.off(node_id, cmds[2])
+                elif cmds[3] == "toggle":
+                    msg = msg + actuator.toggle(node_id, cmds[2])
+                else:
+                    msg = msg + "Switch Command Not Found\n"
+            else:
+                msg = msg + "Device Not Found\n"
+        elif cmds[0] == "-A":
+            actuator = ZwaveActuator(network)
+            if cmds[1] in ("on", "off"):
+                msg = msg + actuator.switch_all(cmds[1] == "on")
+            else:
+                msg = msg + "Switch Command Not Found\n"
+        elif cmds[0] == "-C":
+            actuator = ZwaveActuator(network)
+            if cmds[1] == "list":
+                msg = msg + actuator.list_scenes()
+            elif cmds[1] == "create":
+                msg = msg + actuator.create_scene(cmds[2], \
+                    parse_targets(cmds[3:]) if len(cmds) > 3 else [])
+            elif cmds[1] == "add":
+                msg = msg + actuator.add_to_scene(cmds[2], \
+                    parse_targets(cmds[3:]))
+            elif cmds[1] == "activate":
+                msg = msg + actuator.activate_scene(cmds[2])
+            elif cmds[1] == "remove":
+                msg = msg + actuator.remove_scene(cmds[2])
+            else:
+                msg = msg + "Scene Command Not Found\n"
+        elif cmds[0] == "-i":
+            msg = msg + network.startup_report()
+            msg = msg + node_health.report()
+            msg = msg + poll_schedule.report()
+            msg = msg + wake_queue.report()
+            msg = msg + alarm_lane.report()
+            msg = msg + scan_pool.report()
+            msg = msg + actuate_pool.report()
+            msg = msg + spool.report()
+            msg = msg + http_pool.report()
+            msg = msg + bd_publisher.tokens.report()
+            msg = msg + subscriptions.report()
+            msg = msg + switch_commands.report()
+            msg = msg + scheduler.report()
+        elif cmds[0] == "-q":
+            MAX_THREAD = 1  # dosen't allow any more thread to come 
+            subscriptions.close_all("Disconnected: engine stopped\n")
+            msg = "Bye"
+            exit = True
+    except Exception as e:
+        print(e)
+        msg += "Bad Arguments"
+    return msg, exit
 
 class task_thread(threading.Thread):
     """
@@ -655,56 +3260,387 @@ class task_thread(threading.Thread):
         self.conn = conn
         self.sock = sock
         self.network = network
+        self.lost = False          # client has gone away
+
+    def emit(self, data):
+        """
+            stream a part of response to the client. Once the client has 
+            gone away, the rest of response is discarded, while the command 
+            still runs to the end.
+        """
+        if self.lost:
+            return
+        try:
+            send_frame(self.conn, data)
+        except socket.error as e:
+            print(e)
+            self.lost = True
     
+    def client_gone(self):
+        """
+            Return: True if the client has closed the connection
+        """
+        try:
+            r, w, x = select.select([self.conn], [], [], 0)
+            return bool(r) and self.conn.recv(1, socket.MSG_PEEK) == ""
+        except socket.error:
+            return True
+
+    def subscribe(self, args):
+        """
+            push value updates to the client until it goes away, is too slow 
+            or the engine is stopped.
+
+            Args: args arguments of '-S' command
+            Return: the reason of disconnect
+        """
+        subscriber = Subscriber.parse(args, self.network.subscribe_buffer)
+        if not subscriptions.add(subscriber):
+            return "Too Many Subscribers\n"
+        self.conn.settimeout(KEEPALIVE)   # a client not reading is lost
+        try:
+            while True:
+                updates, closed = subscriber.take(KEEPALIVE)
+                if updates:
+                    self.emit(updates)
+                if closed is not None:
+                    return closed
+                if self.lost or (not updates and self.client_gone()):
+                    subscriber.close("Disconnected: client gone")
+                    return ""
+        finally:
+            subscriptions.remove(subscriber)
+
     def run(self):
         """
             Task implementation
         """
         global threads
         exit = False
-        cmds = str(self.conn.recv(2048)).strip().split()
-        print(cmds)
         msg = ""
         try:
-            if cmds[0] == "-r":
-                node_id = int(cmds[1])
-                sensor = ZwaveSensor(self.network)
-                if node_id == -1:
-                    msg = msg + sensor.snes_all_nodes()
-                elif node_id > 1:
-                    msg = msg + sensor.sens_one_node(node_id)
-            elif cmds[0] == "-w":
-                node_id = int(cmds[1])
-                actuator = ZwaveActuator(self.network)
-                if node_id > 1 and \
-                    actuator.search_switch(node_id, cmds[2]) is not -1:
-                    if cmds[3] == "on":
-                        msg = msg + actuator.on(node_id, cmds[2])
-                    elif cmds[3] == "off":
-                        msg = msg + actuator.off(node_id, cmds[2])
-                    elif cmds[3] == "toggle":
-                        msg = msg + actuator.toggle(node_id, cmds[2])
-                    else:
-                        msg = msg + "Switch Command Not Found\n"
-                else:
-                    msg = msg + "Device Not Found\n"
-            elif cmds[0] == "-q":
-                MAX_THREAD = 1  # dosen't allow any more thread to come 
-                msg = "Bye"
-                exit = True
+            cmds = str(recv_frame(self.conn)).strip().split()
+            print(cmds)
+            if cmds[0] == "-S":
+                msg = self.subscribe(cmds[1:])
+            else:
+                msg, exit = execute_command(self.network, cmds, self.emit)
         except Exception as e:
             print(e)
             msg += "Bad Arguments"
         finally:
-            self.conn.send(msg)
+            try:
+                if msg:
+                    send_frame(self.conn, msg)
+                send_end(self.conn)
+            except Exception as e:
+                print(e)
             self.conn.close()
             if exit:
-                for th in threads:
-                    if th != threading.current_thread():
-                        th.join()
+                with threads_lock:
+                    others = [th for th in threads \
+                        if th != threading.current_thread()]
+                for th in others:
+                    th.join()
                 self.sock.shutdown(socket.SHUT_RDWR)
-            if threading.current_thread() in threads:
-                threads.remove(threading.current_thread())
+            with threads_lock:
+                if threading.current_thread() in threads:
+                    threads.remove(threading.current_thread())
+
+class CommandServer:
+    """
+        Class of CommandServer: an event driven front end of the engine, 
+        which is an alternative to task_thread.
+
+        All client connections are served by one select() loop, so that a 
+        large number of clients can be connected at the same time without 
+        starting one thread per connection. The commands, which may block in 
+        python-openzwave calls, are executed by a bounded number of worker 
+        threads. Commands wait in the loop until a worker is available, 
+        instead of the connection being refused.
+
+        A subscriber ('-S') only takes a worker to be set up, its updates 
+        are then sent by the loop, one frame at a time as the client reads.
+    """
+    def __init__(self, sock, network, workers):
+        """
+            Args:
+                sock: the listening socket
+                network: the instance of ZwaveNetwork
+                workers: number of worker threads executing commands
+            Return: None
+        """
+        self.sock = sock
+        self.sock.setblocking(0)
+        self.network = network
+        self.jobs = Queue.Queue()
+        self.waiting = collections.deque()  # commands waiting for a worker
+        self.inflight = 0                   # commands being executed
+        self.lock = threading.Lock()
+        self.done = collections.deque()     # (conn, data, last) from workers
+        self.wake_r, self.wake_w = os.pipe()
+        self.inbuf = {}                     # conn -> received string
+        self.outbuf = {}                    # conn -> string to be sent
+        self.closing = set()                # conns closed once outbuf sent
+        self.subs = {}                      # conn -> Subscriber
+        self.exit = False
+        self.workers = []
+        for i in range(0, max(1, int(workers))):
+            th = threading.Thread(target=self.work, \
+                name="command-worker-{}".format(i))
+            th.daemon = True
+            self.workers.append(th)
+            th.start()
+
+    def work(self):
+        """
+            worker routine: execute commands and hand the response back to 
+            the loop.
+        """
+        while True:
+            conn, cmds = self.jobs.get()
+            if conn is None:
+                return
+            emit = lambda data: self.reply(conn, \
+                HEADER.pack(len(data)) + data, False)
+            exit = False
+            subscribed = False
+            try:
+                print(cmds)
+                if cmds[0] == "-S":
+                    msg = self.subscribe(conn, cmds[1:])
+                    subscribed = msg is None
+                else:
+                    msg, exit = execute_command(self.network, cmds, emit)
+                if msg:
+                    emit(msg)
+            except Exception as e:
+                print(e)
+                emit("Bad Arguments")
+            finally:
+                # the end frame releases the worker in the loop (inflight)
+                if not subscribed:
+                    self.reply(conn, HEADER.pack(0), True, exit)
+
+    def subscribe(self, conn, args):
+        """
+            set up a subscriber and hand it over to the loop.
+
+            Args:
+                conn: the client connection
+                args: arguments of '-S' command
+            Return: None if subscribed, otherwise the error string
+        """
+        try:
+            subscriber = Subscriber.parse(args, \
+                self.network.subscribe_buffer, self.wake)
+        except Exception as e:
+            print(e)
+            return "Bad Arguments"
+        if not subscriptions.add(subscriber):
+            return "Too Many Subscribers\n"
+        self.reply(conn, "", False, subscriber=subscriber)
+        return None
+
+    def wake(self):
+        """
+            wake up the loop, thread safe.
+        """
+        try:
+            os.write(self.wake_w, "x")
+        except OSError:
+            pass                            # loop has exited
+
+    def reply(self, conn, data, last, exit=False, subscriber=None):
+        """
+            hand framed data over to the loop, thread safe.
+
+            Args:
+                conn: the client connection
+                data: framed string to send
+                last: True if this is the end of response
+                exit: True if the engine need be stopped
+                subscriber: Subscriber whose updates are sent to conn, the 
+                    worker is then released without ending the response
+            Return: None
+        """
+        with self.lock:
+            self.done.append((conn, data, last, exit, subscriber))
+        self.wake()
+
+    def feed(self, conn):
+        """
+            move updates of a subscriber to output buffer, once the previous 
+            updates have been sent.
+        """
+        subscriber = self.subs[conn]
+        if conn not in self.outbuf or self.outbuf[conn]:
+            return
+        updates, closed = subscriber.take()
+        if updates:
+            self.outbuf[conn] += HEADER.pack(len(updates)) + updates
+        if closed is not None:
+            self.outbuf[conn] += HEADER.pack(len(closed)) + closed + \
+                HEADER.pack(0)
+            self.closing.add(conn)
+            del self.subs[conn]
+            subscriptions.remove(subscriber)
+
+    def dispatch(self, conn, cmds):
+        """
+            hand a command to a worker, or let it wait in the loop.
+        """
+        if self.inflight < len(self.workers):
+            self.inflight += 1
+            self.jobs.put((conn, cmds))
+        else:
+            self.waiting.append((conn, cmds))
+
+    def drop(self, conn):
+        """
+            forget and close a client connection.
+        """
+        self.inbuf.pop(conn, None)
+        self.outbuf.pop(conn, None)
+        self.closing.discard(conn)
+        subscriber = self.subs.pop(conn, None)
+        if subscriber is not None:
+            subscriber.close("Disconnected: client gone")
+            subscriptions.remove(subscriber)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def on_accept(self):
+        """
+            accept new client connections.
+        """
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            conn.setblocking(0)
+            self.inbuf[conn] = ""
+
+    def on_read(self, conn):
+        """
+            read from a client, dispatch the command once its frame is 
+            complete.
+        """
+        try:
+            data = conn.recv(65536)
+        except socket.error:
+            data = ""
+        if not data:
+            self.drop(conn)
+            return
+        buf = self.inbuf[conn] + data
+        self.inbuf[conn] = buf
+        if len(buf) < HEADER.size:
+            return
+        (size, ) = HEADER.unpack(buf[:HEADER.size])
+        if len(buf) < HEADER.size + size:
+            return
+        del self.inbuf[conn]                # one command per connection
+        self.outbuf[conn] = ""
+        cmds = buf[HEADER.size:HEADER.size + size].strip().split()
+        self.dispatch(conn, cmds)
+
+    def on_wake(self):
+        """
+            move responses of workers to output buffers.
+        """
+        os.read(self.wake_r, 4096)
+        with self.lock:
+            done = list(self.done)
+            self.done.clear()
+        for conn, data, last, exit, subscriber in done:
+            if conn in self.outbuf:
+                self.outbuf[conn] += data
+            if subscriber is not None:
+                if conn in self.outbuf:
+                    self.subs[conn] = subscriber
+                else:                       # client has gone meanwhile
+                    subscriber.close("Disconnected: client gone")
+                    subscriptions.remove(subscriber)
+                self.inflight -= 1
+                if self.waiting:
+                    self.dispatch(*self.waiting.popleft())
+            if last:
+                self.closing.add(conn)
+                self.inflight -= 1
+                if self.waiting:
+                    self.dispatch(*self.waiting.popleft())
+            if exit:
+                self.exit = True
+        for conn in list(self.closing):
+            if conn not in self.outbuf:
+                self.closing.discard(conn)
+        for conn in list(self.subs):
+            self.feed(conn)
+
+    def on_hangup(self, conn):
+        """
+            check a subscribed client, which is not expected to send 
+            anything but closing the connection.
+        """
+        try:
+            data = conn.recv(4096)
+        except socket.error:
+            data = ""
+        if not data:
+            self.drop(conn)
+
+    def on_write(self, conn):
+        """
+            send buffered responses, close connection once it is done.
+        """
+        try:
+            sent = conn.send(self.outbuf[conn])
+        except socket.error:
+            self.drop(conn)
+            return
+        self.outbuf[conn] = self.outbuf[conn][sent:]
+        if not self.outbuf[conn] and conn in self.closing:
+            self.drop(conn)
+        elif not self.outbuf[conn] and conn in self.subs:
+            self.feed(conn)
+
+    def serve_forever(self):
+        """
+            run the loop until the engine is asked to quit by '-q' and all 
+            pending responses have been sent.
+
+            Args: None
+            Return: None
+        """
+        while not (self.exit and self.inflight == 0 and not self.outbuf):
+            rlist = [self.wake_r]
+            if not self.exit:
+                rlist = rlist + [self.sock] + list(self.inbuf) + \
+                    list(self.subs)
+            wlist = [c for c in self.outbuf if self.outbuf[c]]
+            r, w, x = select.select(rlist, wlist, [])
+            for fd in r:
+                if fd is self.wake_r:
+                    self.on_wake()
+                elif fd is self.sock:
+                    self.on_accept()
+                elif fd in self.inbuf:
+                    self.on_read(fd)
+                elif fd in self.subs:
+                    self.on_hangup(fd)
+            for conn in w:
+                if conn in self.outbuf:
+                    self.on_write(conn)
+        for conn in list(self.inbuf):
+            self.drop(conn)
+        for th in self.workers:
+            self.jobs.put((None, None))
+        os.close(self.wake_r)
+        os.close(self.wake_w)
 
 def socket_init():
     """
@@ -725,52 +3661,149 @@ def socket_init():
         sys.exit("Socket Creation Failed\n" + str(e))
 
 
-def louie_network_ready():
+def louie_network_ready(network):
     """
         initial signal handler
     """
-    dispatcher.connect(louie_value_update, ZWaveNetwork.SIGNAL_VALUE)
+    value_index.build(network)
+    switch_index.build(network)
+    node_health.seed(network)
+    poll_schedule.apply(network)
+    listen.resolve(network)
+    snapshot.seed(network)
+
+def louie_notification(network, args):
+    """
+        signal handler of notifications, node notifications (Dead, Alive, 
+        Awake, Sleep) update the health table
+    """
+    if node_health is not None and "nodeId" in args:
+        node_health.notify(args["nodeId"], args.get("notificationCode"))
+        if str(args.get("notificationCode")) == "Awake":
+            wake_queue.wake(args["nodeId"])
+
+def louie_value_added(network, node, value):
+    """
+        signal handler when a value is added, update value index
+    """
+    value_index.add_value(node, value.value_id)
+    switch_index.add_value(node, value)
+    poll_schedule.add_value(node.node_id, value)
+
+def louie_value_removed(network, node, value):
+    """
+        signal handler when a value is removed, update value index
+    """
+    value_index.remove_value(node.node_id, value.value_id)
+    switch_index.remove_value(node.node_id, value.value_id)
+    switch_states.forget(value.value_id)
+    poll_schedule.forget(value.value_id)
+    listen.forget(value.value_id)
+    snapshot.forget(node.node_id, value.value_id)
+    rules.forget(value.value_id)
+    identities.invalidate(node.node_id, value.value_id)
+
+def louie_node_added(network, node):
+    """
+        signal handler when a node is added, update value index
+    """
+    value_index.add_node(node)
+    switch_index.add_node(node)
+    identities.invalidate(node.node_id)
+
+def louie_node_removed(network, node):
+    """
+        signal handler when a node is removed, update value index
+    """
+    value_index.remove_node(node.node_id)
+    switch_index.remove_node(node.node_id)
+    node_health.forget(node.node_id)
+    poll_schedule.forget_node(node.node_id)
+    wake_queue.drop(node.node_id)
+    identities.invalidate(node.node_id)
+
+def louie_node_info(network, node):
+    """
+        signal handler when a node is renamed or re-interviewed, drop the 
+        identities of the node
+    """
+    identities.invalidate(node.node_id)
 
 
 def louie_value_update(network, node, value):
     """
         signal handler when value is received/updated
 
-        $$ only update of 'alarme type value' will be processed.
+        $$ the latest value of all listened values is kept in snapshot.
+        $$ only update of 'alarme type value' will be posted, and only if 
+        the publishing rules (deadband, interval) of the point allow.
+        $$ the alarm is handed to the alarm lane first, whose workers spool 
+        and post it at once, off this thread, the latency from here to 
+        the acknowledgement of building depot is recorded.
     """
-    global threads
-    global listen
-    if node.node_id in listen \
-        and value.label in listen[node.node_id] \
-        and len(threads) < MAX_THREAD \
-        and ZwaveSensor.is_alarm(network, node.node_id, value.value_id):
-        data = {"sensor_data":{}}
+    received = time.time()
+    if switch_index.is_switch(value.value_id):
+        switch_states.confirm(value.value_id, value.data)
+    poll_schedule.observe(value.value_id, value.data)
+    if not listen.accept(node.node_id, value):
+        return
+    current = value.data
+    if ZwaveSensor.is_alarm(network, node.node_id, value.value_id) \
+        and rules.accept(node.node_id, value, current, received):
+        data = {"sensor_data":{}, "time": received}
         sdata = {}
-        sdata["mac_id"] = ZwaveSensor.get_mac_id(node, value)
+        sdata["mac_id"] = identities.get(network, node, value)[0]
         sdata[value.label] = value.data_as_string     
         data["sensor_data"].update(sdata)
-        # start a new thread for posting data
-        newthread = threading.Thread(target=alarm_thread_post_bd, \
-                    args=(copy.deepcopy(data),))
-        threads.append(newthread)
-        newthread.start()
+        alarm_lane.submit(data, received)
+    snapshot.update(node.node_id, value.value_id, current, received)
+    kinds = value_index.kinds(node, value.value_id)
+    subscriptions.publish(node.node_id, value, current, \
+        kinds if kinds else (KIND_ALARM, ))
 
-def alarm_thread_post_bd(data):
+def run_job(job):
     """
-        a thread routine to post the passed in data to building depot
-    
-        Args: snesed data:
-            sensor_data: {
-                <attribute/meta data>
-                <sensor data>
-            }
+        a worker routine of actuate pool to run one command.
+
+        Args: job the routine sending the command
+        Return: None
+    """
+    job()
+
+def scan_node(scan):
+    """
+        a worker routine of scan pool to read one node.
+
+        Args: scan the instance of NodeScan
         Return: None
     """
-    print(data)
-    print(get_json(json.dumps(data)))   # has some issues here!
-    # remove from pool after finishing
-    if threading.current_thread() in threads:
-        threads.remove(threading.current_thread())
+    scan.run()
+
+def serve_threads(sock, network):
+    """
+        Thread per connection front end: each client connection is handled 
+        by a new task_thread, and the connection is closed once MAX_THREAD 
+        threads are running.
+
+        Args:
+            sock: the listening socket
+            network: the instance of ZwaveNetwork
+        Return: None once the socket is closed by quit command
+    """
+    try:
+        while True:
+            (conn, (ip, port)) = sock.accept()
+            with threads_lock:
+                full = len(threads) >= MAX_THREAD
+                if not full:
+                    newthread = task_thread(conn, sock, network)
+                    threads.append(newthread)
+            if full:
+                conn.close()
+            else:
+                newthread.start()
+    except Exception as e:         # if socket is closed by quit thread
+        return
 
 def main():
     """
@@ -784,30 +3817,88 @@ def main():
         be ran under usdo permission.
     """ 
     global threads
+    global alarm_lane
+    global alarm_http_pool
+    global scan_pool
+    global actuate_pool
+    global subscriptions
+    global spool
+    global value_index
+    global switch_index
+    global switch_states
+    global switch_commands
+    global scheduler
+    global node_health
+    global poll_schedule
+    global wake_queue
+    global identities
+    global snapshot
+    global http_pool
+    global bd_publisher
     network = ZwaveNetwork()
-    network.network_init()
+    scheduler = MeshScheduler(network.tx_per_second, network.tx_burst)
+    node_health = NodeHealth(network.probe_interval)
+    poll_schedule = PollSchedule(network.poll)
+    wake_queue = WakeQueue(network.wake_history)
+    # keep-alive connections to building depot, one per posting thread
+    http_pool = HTTPPool(network.post_workers + 1, network.http_timeout)
+    bd_publisher = BDPublisher(Setting("bd_setting").setting, http_pool, \
+        **network.token_options)
+    spool = Spool(bd_publisher.post, **network.spool_options)
+    value_index = ValueIndex()
+    switch_index = SwitchIndex()
+    switch_states = SwitchStates(network.verify_timeout)
+    switch_commands = SwitchCommands(network.coalesce_window)
+    identities = IdentityCache()
+    snapshot = ValueSnapshot(network.stale_after)
+    subscriptions = Subscriptions(network.max_subscribers)
+    scan_pool = PostWorkerPool(scan_node, network.scan_workers, \
+        DEFAULT_QUEUE_SIZE, "scan")
+    actuate_pool = PostWorkerPool(run_job, network.actuate_workers, \
+        DEFAULT_QUEUE_SIZE, "actuate")
+    # alarms are spooled, then posted over connections of their own
+    alarm_http_pool = HTTPPool(network.alarm_workers, network.http_timeout)
+    alarm_lane = AlarmLane(bd_publisher.over(alarm_http_pool).post, spool, \
+        network.alarm_workers, network.alarm_queue_size)
+    # all handlers are connected before the network is started, otherwise 
+    # a network which is ready at once would never build the indexes
+    dispatcher.connect(louie_notification, ZWaveNetwork.SIGNAL_NOTIFICATION)
     dispatcher.connect(louie_network_ready, ZWaveNetwork.SIGNAL_NETWORK_READY)
-    network.config_all_nodes()
+    dispatcher.connect(louie_value_added, ZWaveNetwork.SIGNAL_VALUE_ADDED)
+    dispatcher.connect(louie_value_removed, ZWaveNetwork.SIGNAL_VALUE_REMOVED)
+    dispatcher.connect(louie_node_added, ZWaveNetwork.SIGNAL_NODE_ADDED)
+    dispatcher.connect(louie_node_removed, ZWaveNetwork.SIGNAL_NODE_REMOVED)
+    dispatcher.connect(louie_node_info, ZWaveNetwork.SIGNAL_NODE_NAMING)
+    dispatcher.connect(louie_node_info, ZWaveNetwork.SIGNAL_NODE_PROTOCOL_INFO)
+    dispatcher.connect(louie_value_update, ZWaveNetwork.SIGNAL_VALUE)
+    network.network_init()
     network.network_awake()
+    # nodes are known once the network is ready, parameters of sleeping 
+    # nodes are pushed when they wake up
+    network.config_all_nodes()
+    node_health.start()
+    poll_schedule.start()
     sock = socket_init()
 
-    try:
-        while True:
-            (conn, (ip, port)) = sock.accept()
-            if len(threads) >= MAX_THREAD:
-                conn.close()
-            else:
-                newthread = task_thread(conn, sock, network)
-                threads.append(newthread)
-                newthread.start()
-    except Exception as e:         # if socket is closed by quit thread
-        print("Socket Closed, Program Exited")
-        sock.close()               # close socket
-        network.network_stop()
-        sys.exit("Bye")            # terminated program
+    if network.server == SERVER_EVENT:
+        CommandServer(sock, network, network.server_workers).serve_forever()
+    else:
+        serve_threads(sock, network)
+    print("Socket Closed, Program Exited")
+    sock.close()                   # close socket
+    scan_pool.stop(network.node_timeout)
+    actuate_pool.stop(network.verify_timeout)
+    node_health.stop()
+    poll_schedule.stop()
+    alarm_lane.stop(network.http_timeout)
+    print(alarm_lane.report())
+    spool.stop()                   # backlog is replayed at next start
+    print(spool.report())
+    bd_publisher.stop()            # token is kept for next start
+    http_pool.close()
+    alarm_http_pool.close()
+    network.network_stop()
+    sys.exit("Bye")                # terminated program
 
 if __name__ == "__main__":
     main()
-
-
-